@@ -31,9 +31,14 @@ import androidx.core.app.ActivityCompat
 import com.example.remotecontrol.ui.theme.RemoteControlTheme
 import kotlinx.coroutines.CoroutineScope
 import kotlinx.coroutines.Dispatchers
+import kotlinx.coroutines.Job
+import kotlinx.coroutines.delay
+import kotlinx.coroutines.isActive
 import kotlinx.coroutines.launch
+import kotlinx.coroutines.withTimeoutOrNull
 import java.io.IOException
 import java.util.*
+import java.util.concurrent.atomic.AtomicInteger
 
 class MainActivity : ComponentActivity() {
     private var bluetoothSocket: BluetoothSocket? = null
@@ -46,6 +51,18 @@ class MainActivity : ComponentActivity() {
     private val wifiPort = 8888
     private val uuid: UUID = UUID.fromString("00001101-0000-1000-8000-00805F9B34FB")
     
+    // 心跳配置 - 间隔需短于树莓派端 RPI_HEARTBEAT_INTERVAL，空闲时也能保持连接
+    private val heartbeatIntervalMs = 1000L
+    private var heartbeatJob: Job? = null
+    
+    // 显示通道信用流控 - 连接后发送 FLOW:ON，每条显示命令 (OLED/IMG/ICON) 占用一个信用，
+    // 树莓派处理完后通过 CREDIT:<剩余信用> 归还；信用用完时等待，超时仍没有信用则放弃这条命令
+    private val displayCommandPrefixes = listOf("OLED", "IMG:", "ICON")
+    private val creditWaitTimeoutMs = 2000L
+    private val creditPollIntervalMs = 20L
+    private val displayCredits = AtomicInteger(0)
+    private var responseReaderJob: Job? = null
+    
     // 连接状态 - 使用 mutableStateOf 以便 Compose 可以观察
     private var _isBluetoothConnected = mutableStateOf(false)
     private var _isWifiConnected = mutableStateOf(false)
@@ -82,6 +99,8 @@ class MainActivity : ComponentActivity() {
                         onDisconnect = {
                             CoroutineScope(Dispatchers.IO).launch {
                                 try {
+                                    stopHeartbeat()
+                                    stopResponseReader()
                                     bluetoothSocket?.close()
                                     wifiSocket?.close()
                                     _isBluetoothConnected.value = false
@@ -338,6 +357,8 @@ class MainActivity : ComponentActivity() {
                     println("⚠️ 握手过程出现异常: ${e.message}")
                 }
                 
+                enableFlowControl()
+                startHeartbeat()
                 return true
             } else {
                 println("❌ 所有连接方法都失败了")
@@ -388,6 +409,8 @@ class MainActivity : ComponentActivity() {
         CoroutineScope(Dispatchers.IO).launch {
             try {
                 var success = false
+                // 命令以换行分帧，文本中的换行转义为 "\\n" 由树莓派端还原
+                val frame = command.replace("\n", "\\n") + "\n"
                 
                 // 优先尝试蓝牙连接
                 if (isBluetoothConnected && bluetoothSocket?.isConnected == true) {
@@ -397,30 +420,19 @@ class MainActivity : ComponentActivity() {
                             println("📏 命令长度: ${command.length} 字符")
                             println("📝 命令字节: ${command.toByteArray().contentToString()}")
                             
-                            outputStream.write(command.toByteArray())
-                            outputStream.flush()
-                            println("📤 命令已发送")
-                            
-                            // 尝试读取响应
-                            bluetoothSocket?.inputStream?.let { inputStream ->
-                                try {
-                                    val response = ByteArray(1024)
-                                    val bytesRead = inputStream.read(response)
-                                    if (bytesRead > 0) {
-                                        val responseStr = String(response, 0, bytesRead)
-                                        println("📥 服务端响应: '$responseStr' (${bytesRead} 字节)")
-                                        
-                                        runOnUiThread {
-                                            Toast.makeText(this@MainActivity, "收到响应: $responseStr", Toast.LENGTH_SHORT).show()
-                                        }
-                                    } else {
-                                        println("⚠️  未收到响应数据")
-                                    }
-                                } catch (e: Exception) {
-                                    println("❌ 读取响应失败: ${e.message}")
+                            // 显示命令先取得信用，避免树莓派显示通道积压后丢弃 (响应由 startResponseReader 读取)
+                            if (displayCommandPrefixes.any { command.startsWith(it) } && !acquireDisplayCredit()) {
+                                println("🚦 显示通道繁忙，放弃命令: '$command'")
+                                runOnUiThread {
+                                    Toast.makeText(this@MainActivity, "显示繁忙，请稍后再试", Toast.LENGTH_SHORT).show()
                                 }
+                                return@launch
                             }
                             
+                            outputStream.write(frame.toByteArray())
+                            outputStream.flush()
+                            println("📤 命令已发送")
+                            
                             success = true
                             runOnUiThread {
                                 Toast.makeText(this@MainActivity, "蓝牙命令发送成功", Toast.LENGTH_SHORT).show()
@@ -439,7 +451,7 @@ class MainActivity : ComponentActivity() {
                 if (!success && isWifiConnected && wifiSocket?.isConnected == true) {
                     try {
                         wifiSocket?.outputStream?.let { outputStream ->
-                            outputStream.write(command.toByteArray())
+                            outputStream.write(frame.toByteArray())
                             outputStream.flush()
                             success = true
                             runOnUiThread {
@@ -465,7 +477,7 @@ class MainActivity : ComponentActivity() {
                         // 连接成功后重新发送命令
                         try {
                             bluetoothSocket?.outputStream?.let { outputStream ->
-                                outputStream.write(command.toByteArray())
+                                outputStream.write(frame.toByteArray())
                                 outputStream.flush()
                                 success = true
                                 runOnUiThread {
@@ -496,8 +508,115 @@ class MainActivity : ComponentActivity() {
         }
     }
     
+    private fun startHeartbeat() {
+        heartbeatJob?.cancel()
+        heartbeatJob = CoroutineScope(Dispatchers.IO).launch {
+            println("💓 启动心跳，间隔 ${heartbeatIntervalMs}ms")
+            while (isActive && isBluetoothConnected) {
+                delay(heartbeatIntervalMs)
+                try {
+                    bluetoothSocket?.outputStream?.let { outputStream ->
+                        outputStream.write("PING\n".toByteArray())
+                        outputStream.flush()
+                    }
+                } catch (e: IOException) {
+                    println("💔 心跳发送失败: ${e.message}")
+                    _isBluetoothConnected.value = false
+                }
+            }
+        }
+    }
+    
+    private fun stopHeartbeat() {
+        heartbeatJob?.cancel()
+        heartbeatJob = null
+    }
+    
+    private fun enableFlowControl() {
+        // 开启后树莓派的响应以换行结尾，并在处理完显示命令后推送 CREDIT 帧
+        displayCredits.set(0)
+        try {
+            bluetoothSocket?.outputStream?.let { outputStream ->
+                outputStream.write("FLOW:ON\n".toByteArray())
+                outputStream.flush()
+                println("🚦 已请求开启显示通道流控")
+            }
+        } catch (e: IOException) {
+            println("⚠️ 开启流控失败: ${e.message}")
+        }
+        startResponseReader()
+    }
+    
+    private fun startResponseReader() {
+        responseReaderJob?.cancel()
+        val inputStream = bluetoothSocket?.inputStream ?: return
+        responseReaderJob = CoroutineScope(Dispatchers.IO).launch {
+            val buffer = ByteArray(1024)
+            val pending = StringBuilder()
+            try {
+                while (isActive && isBluetoothConnected) {
+                    val bytesRead = inputStream.read(buffer)
+                    if (bytesRead < 0) break
+                    pending.append(String(buffer, 0, bytesRead))
+                    var newline = pending.indexOf("\n")
+                    while (newline >= 0) {
+                        val line = pending.substring(0, newline).trim()
+                        pending.delete(0, newline + 1)
+                        if (line.isNotEmpty()) {
+                            handleServerLine(line)
+                        }
+                        newline = pending.indexOf("\n")
+                    }
+                }
+            } catch (e: IOException) {
+                println("❌ 读取响应失败: ${e.message}")
+            }
+        }
+    }
+    
+    private fun stopResponseReader() {
+        responseReaderJob?.cancel()
+        responseReaderJob = null
+        displayCredits.set(0)
+    }
+    
+    private fun handleServerLine(line: String) {
+        when {
+            line.startsWith("CREDIT:") -> {
+                line.removePrefix("CREDIT:").toIntOrNull()?.let { displayCredits.set(it) }
+            }
+            line.startsWith("OK:FLOW:") -> {
+                line.removePrefix("OK:FLOW:").toIntOrNull()?.let { displayCredits.set(it) }
+                println("🚦 流控已开启，显示通道信用: ${displayCredits.get()}")
+            }
+            line.startsWith("TLM:") -> Unit
+            else -> {
+                println("📥 服务端响应: '$line'")
+                runOnUiThread {
+                    Toast.makeText(this@MainActivity, "收到响应: $line", Toast.LENGTH_SHORT).show()
+                }
+            }
+        }
+    }
+    
+    private suspend fun acquireDisplayCredit(): Boolean {
+        return withTimeoutOrNull(creditWaitTimeoutMs) {
+            var acquired = false
+            while (!acquired) {
+                val credits = displayCredits.get()
+                acquired = credits > 0 && displayCredits.compareAndSet(credits, credits - 1)
+                if (!acquired) {
+                    delay(creditPollIntervalMs)
+                }
+            }
+            true
+        } ?: false
+    }
+    
     override fun onDestroy() {
         super.onDestroy()
+        stopHeartbeat()
+        stopResponseReader()
         try {
             bluetoothSocket?.close()
             wifiSocket?.close()
@@ -11,12 +11,27 @@ import time
 import threading
 import signal
 import sys
+import json
 
 class BluetoothPairingHelper:
-    def __init__(self):
+    def __init__(self, agent_mode=False):
         self.running = True
         self.pin_code = "0000"  # 默认PIN码
         
+        # 代理模式: 作为遥控器服务端的子进程运行，stdout 只输出 JSON 事件，日志改走 stderr
+        self.agent_mode = agent_mode
+        self.event_stream = sys.stdout
+        if agent_mode:
+            sys.stdout = sys.stderr
+        
+    def emit(self, event, **fields):
+        """代理模式下向主进程发送一行 JSON 事件"""
+        if not self.agent_mode:
+            return
+        fields["event"] = event
+        self.event_stream.write(json.dumps(fields, ensure_ascii=False) + "\n")
+        self.event_stream.flush()
+        
     def run_command(self, cmd):
         """执行系统命令"""
         try:
@@ -73,6 +88,9 @@ class BluetoothPairingHelper:
                 try:
                     # 读取输出
                     output = process.stdout.readline()
+                    if not output and process.poll() is not None:
+                        print("❌ bluetoothctl 已退出")
+                        break
                     if output:
                         output = output.strip()
                         print(f"📟 {output}")
@@ -82,6 +100,7 @@ class BluetoothPairingHelper:
                             print(f"🔑 收到PIN码请求，发送: {self.pin_code}")
                             process.stdin.write(f"{self.pin_code}\n")
                             process.stdin.flush()
+                            self.emit("display", text=f"PIN: {self.pin_code}\nSent")
                             
                         elif "Confirm passkey" in output:
                             # 提取密钥
@@ -91,6 +110,7 @@ class BluetoothPairingHelper:
                                 passkey = passkey_match.group(1)
                                 print(f"🔑 收到密钥确认请求: {passkey}")
                                 print("📱 请在安卓设备上确认相同的密钥!")
+                                self.emit("display", text=f"Confirm:\n{passkey}")
                                 
                             print("✅ 自动确认配对密钥")
                             process.stdin.write("yes\n")
@@ -101,6 +121,7 @@ class BluetoothPairingHelper:
                             print("✅ 自动确认配对")
                             process.stdin.write("yes\n")
                             process.stdin.flush()
+                            self.emit("display", text="Confirming\nPairing...")
                             
                         elif "[agent] Confirm passkey" in output:
                             # 处理代理确认请求
@@ -110,6 +131,7 @@ class BluetoothPairingHelper:
                                 passkey = passkey_match.group(1)
                                 print(f"🔑 代理密钥确认: {passkey}")
                                 print("📱 请在安卓设备上确认相同的密钥!")
+                                self.emit("display", text=f"Key: {passkey}\nConfirm on phone")
                             process.stdin.write("yes\n")
                             process.stdin.flush()
                             
@@ -117,15 +139,23 @@ class BluetoothPairingHelper:
                             print("✅ 授权服务")
                             process.stdin.write("yes\n")
                             process.stdin.flush()
+                            self.emit("display", text="Service\nAuthorized")
                             
                         elif "Pairing successful" in output:
                             print("🎉 配对成功！")
+                            self.emit("display", text="Pairing\nSuccess!")
                             
                         elif "Failed to pair" in output:
                             print("❌ 配对失败，请重试")
+                            self.emit("display", text="Pairing\nFailed")
                             
                         elif "Request canceled" in output:
                             print("⚠️  配对请求被取消，可能是超时或用户取消")
+                            self.emit("display", text="Pairing\nCanceled")
+                            
+                        elif "NEW" in output and "Device" in output:
+                            print("📱 发现新设备尝试配对")
+                            self.emit("display", text="Device Found\nPairing...")
                             
                 except Exception as e:
                     if self.running:
@@ -208,7 +238,26 @@ class BluetoothPairingHelper:
         self.running = False
         sys.exit(0)
 
+def run_agent():
+    """非交互的配对代理模式，由遥控器服务端作为子进程启动并监管"""
+    helper = BluetoothPairingHelper(agent_mode=True)
+    if "--pin" in sys.argv:
+        helper.pin_code = sys.argv[sys.argv.index("--pin") + 1]
+    
+    signal.signal(signal.SIGINT, helper.signal_handler)
+    signal.signal(signal.SIGTERM, helper.signal_handler)
+    
+    helper.setup_bluetooth()
+    helper.emit("display", text="Pairing Ready\nWaiting...")
+    helper.monitor_pairing_requests()
+    # 走到这里说明 bluetoothctl 异常退出，返回非零让主进程重启代理
+    sys.exit(1)
+
 def main():
+    if "--agent" in sys.argv:
+        run_agent()
+        return
+    
     print("=" * 60)
     print("🔵 蓝牙配对助手")
     print("=" * 60)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+命令跟踪格式
+控制器的常开二进制环形缓冲区及跟踪文件读写，不依赖任何硬件模块，重放工具可以直接导入
+"""
+
+import itertools
+import os
+import struct
+import time
+
+# 每条记录为 (monotonic 时间, 类型, 附加, 原始长度, 数值) + 截断的负载
+TRACE_HEADER = struct.Struct("<dBBHf")
+TRACE_PAYLOAD = 112  # 负载最多保存的字节数，超出部分截断
+TRACE_RECORD_SIZE = TRACE_HEADER.size + TRACE_PAYLOAD
+TRACE_FILE_HEADER = struct.Struct("<4sHHIdd")  # 魔数, 版本, 记录大小, 记录数, 写盘时的系统时间, 写盘时的 monotonic 时间
+TRACE_MAGIC = b"RPTR"
+TRACE_VERSION = 1
+TRACE_RX = 1  # 收到的帧 (附加: 0 蓝牙, 1 本机接口)
+TRACE_RESP = 2  # 发送的响应 (附加同上)
+TRACE_ACTUATE = 3  # 舵机输出 (附加: 舵机序号, 数值: 角度)
+TRACE_LINK = 4  # 链路事件 (附加: 0 断开, 1 连接, 2 链路丢失)
+
+
+class TraceRecorder:
+    """预分配的二进制环形跟踪缓冲区，记录时不加锁 (槽位由原子计数器分配)"""
+    
+    def __init__(self, records):
+        self.records = records
+        self.buffer = bytearray(records * TRACE_RECORD_SIZE)
+        self.counter = itertools.count()
+    
+    def record(self, kind, aux=0, value=0.0, data=None, start=0, end=0):
+        """写入一条记录，data[start:end] 为负载 (超出 TRACE_PAYLOAD 的部分截断)"""
+        offset = next(self.counter) % self.records * TRACE_RECORD_SIZE
+        length = end - start
+        TRACE_HEADER.pack_into(self.buffer, offset, time.monotonic(), kind, aux, length, value)
+        if length:
+            length = min(length, TRACE_PAYLOAD)
+            offset += TRACE_HEADER.size
+            self.buffer[offset:offset + length] = data[start:start + length]
+    
+    def dump(self, path):
+        """按时间顺序把缓冲区中的记录写入文件，返回记录数"""
+        snapshot = bytes(self.buffer)
+        records = [snapshot[offset:offset + TRACE_RECORD_SIZE]
+                   for offset in range(0, len(snapshot), TRACE_RECORD_SIZE)
+                   if TRACE_HEADER.unpack_from(snapshot, offset)[0]]  # 时间为 0 的是空槽
+        records.sort(key=lambda record: TRACE_HEADER.unpack_from(record)[0])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(TRACE_FILE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_RECORD_SIZE,
+                                           len(records), time.time(), time.monotonic()))
+            f.writelines(records)
+        os.replace(tmp_path, path)
+        return len(records)
+
+
+def read_trace(path):
+    """读取跟踪文件，返回 (文件头, 记录列表)；记录为 (时间, 类型, 附加, 原始长度, 数值, 负载)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    header = TRACE_FILE_HEADER.unpack_from(data)
+    magic, version, record_size, count = header[:4]
+    if magic != TRACE_MAGIC or version != TRACE_VERSION or record_size != TRACE_RECORD_SIZE:
+        raise ValueError(f"unsupported trace file: {magic!r} v{version} record size {record_size}")
+    records = []
+    for i in range(count):
+        offset = TRACE_FILE_HEADER.size + i * record_size
+        timestamp, kind, aux, length, value = TRACE_HEADER.unpack_from(data, offset)
+        payload_start = offset + TRACE_HEADER.size
+        payload = data[payload_start:payload_start + min(length, TRACE_PAYLOAD)]
+        records.append((timestamp, kind, aux, length, value, payload))
+    return header, records
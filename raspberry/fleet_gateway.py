@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多台树莓派遥控器网关
+接受一个客户端连接，通过持久连接把命令转发或广播到多台控制器
+
+控制器端需开启本机控制 TCP 端口，绑定到网关所在网段的网卡地址并设置共享令牌，例如:
+    RPI_LOCAL_TCP_HOST=192.168.1.21 RPI_LOCAL_TCP_PORT=8889 RPI_LOCAL_TOKEN=<令牌> python3 raspberry_pi_controller.py
+该端口可执行校准、写图标等命令，不要暴露在不可信的网络上
+
+网关默认只监听本机 (RPI_GATEWAY_HOST=127.0.0.1)；监听其他地址时必须配置令牌，
+客户端连接后第一行发送 AUTH:<令牌>，收到 OK:AUTH 后再发送命令
+
+配置文件 (fleet_config.json，令牌也可用环境变量 RPI_FLEET_TOKEN 提供):
+    {
+        "token": "<令牌>",
+        "controllers": {
+            "left": "192.168.1.21:8889",
+            "right": "192.168.1.22:8889",
+            "self": "unix:/tmp/rpi_controller.sock"
+        },
+        "groups": {"arms": ["left", "right"]}
+    }
+
+客户端命令 (换行分帧):
+    SERVO1:90              不带地址时发给所有控制器
+    @left:SERVO1:90        发给单台控制器，原样返回其响应
+    @arms:OLED:Hello       发给一组控制器
+    @left,right:CENTER     逗号分隔多个目标
+    @all+200:SERVO2:45     "+毫秒" 指定同步延迟，+0 表示不同步
+    FLEET?                 查询各控制器连接状态
+
+发给多台控制器的命令会包装为 AT:<unix_ms>:<命令>，各控制器在同一时刻执行 (需 NTP 同步时钟)
+"""
+
+import hmac
+import socket
+import threading
+import time
+import signal
+import sys
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+# 网关配置 (可通过环境变量覆盖)
+FLEET_CONFIG = os.environ.get(
+    "RPI_FLEET_CONFIG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fleet_config.json"))
+GATEWAY_HOST = os.environ.get("RPI_GATEWAY_HOST", "127.0.0.1")
+GATEWAY_PORT = int(os.environ.get("RPI_GATEWAY_PORT", "8888"))
+# 多目标命令统一延后执行的时间，需大于到最慢控制器的单程延迟
+SYNC_DELAY_MS = int(os.environ.get("RPI_FLEET_SYNC_DELAY_MS", "80"))
+REPLY_TIMEOUT = float(os.environ.get("RPI_FLEET_REPLY_TIMEOUT", "2.0"))  # 秒
+RECONNECT_DELAY = 1.0  # 秒，连接失败后在此期间内直接返回 LINK_DOWN，不反复重连
+RX_BUFFER_SIZE = 4096  # 同时也是客户端单帧的长度上限
+HEARTBEAT_COMMANDS = ("PING", "HB")
+IMMEDIATE_COMMANDS = ("STOP",)  # 急停不做延后同步，立即下发
+
+
+def is_loopback_host(host):
+    """监听地址是否只允许本机访问"""
+    return host == "localhost" or host.startswith("127.") or host == "::1"
+
+
+class ControllerLink:
+    """到一台控制器的持久连接，断开后在下次请求时自动重连
+
+    每台控制器同一时间只有一条在途命令，不会超出控制器显示通道的信用窗口
+    """
+
+    def __init__(self, name, address, token=""):
+        self.name = name
+        self.address = address
+        self.token = token
+        self.sock = None
+        self.reader = None
+        self.lock = threading.Lock()
+        self.retry_at = 0.0
+
+    def open_socket(self):
+        """按地址类型建立连接 (unix:<路径> 或 <主机>:<端口>)"""
+        if self.address.startswith("unix:"):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(REPLY_TIMEOUT)
+            sock.connect(self.address[5:])
+            return sock
+        host, port = self.address.rsplit(":", 1)
+        sock = socket.create_connection((host, int(port)), timeout=REPLY_TIMEOUT)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def connect(self):
+        """建立连接 (TCP 连接先发送令牌)，失败后 RECONNECT_DELAY 内不再重试"""
+        now = time.monotonic()
+        if now < self.retry_at:
+            return False
+        try:
+            self.sock = self.open_socket()
+            self.reader = self.sock.makefile("rb")
+            if self.token and not self.address.startswith("unix:"):
+                self.sock.sendall(f"AUTH:{self.token}\n".encode('utf-8'))
+                if self.reader.readline().strip() != b"OK:AUTH":
+                    raise ConnectionError("controller rejected the token")
+            print(f"🔗 已连接控制器 {self.name} ({self.address})")
+            return True
+        except (OSError, ValueError) as e:
+            self.close()
+            self.retry_at = now + RECONNECT_DELAY
+            print(f"⚠️ 无法连接控制器 {self.name} ({self.address}): {e}")
+            return False
+
+    def close(self):
+        """关闭连接"""
+        for stream in (self.reader, self.sock):
+            if stream:
+                try:
+                    stream.close()
+                except OSError:
+                    pass
+        self.reader = None
+        self.sock = None
+
+    def request(self, command):
+        """发送一条命令并等待一行响应"""
+        with self.lock:
+            # 复用的连接可能已被对端关闭，此时换新连接重发一次
+            reused = self.sock is not None
+            if not reused and not self.connect():
+                return "ERROR:LINK_DOWN"
+            while True:
+                try:
+                    self.sock.sendall(command.encode('utf-8') + b"\n")
+                    line = self.reader.readline()
+                    if not line:
+                        raise ConnectionError("connection closed by controller")
+                    return line.decode('utf-8', 'replace').strip()
+                except socket.timeout:
+                    # 命令可能已执行，不重发
+                    print(f"⏰ 控制器 {self.name} 响应超时")
+                    self.close()
+                    return "ERROR:TIMEOUT"
+                except OSError as e:
+                    print(f"⚠️ 控制器 {self.name} 连接断开: {e}")
+                    self.close()
+                    if not reused or not self.connect():
+                        return "ERROR:LINK_DOWN"
+                    reused = False
+
+    def status(self):
+        """连接状态"""
+        return "up" if self.sock is not None else "down"
+
+
+class FleetGateway:
+    def __init__(self, config):
+        self.token = os.environ.get("RPI_FLEET_TOKEN", config.get("token", ""))
+        self.links = {name: ControllerLink(name, address, self.token)
+                      for name, address in config.get("controllers", {}).items()}
+        self.groups = {name: list(members) for name, members in config.get("groups", {}).items()}
+        self.groups["all"] = list(self.links)
+        for group, members in self.groups.items():
+            unknown = [name for name in members if name not in self.links]
+            if unknown:
+                raise ValueError(f"group {group} references unknown controllers: {unknown}")
+        self.pool = ThreadPoolExecutor(max_workers=max(len(self.links), 1))
+        self.server_socket = None
+        self.client_socket = None
+        self.is_running = True
+
+    def resolve_targets(self, spec):
+        """把目标描述 (名称/组名，逗号分隔) 展开为控制器名称列表，未知目标返回 None"""
+        names = []
+        for target in spec.split(","):
+            target = target.strip()
+            if target in self.links:
+                members = [target]
+            elif target in self.groups:
+                members = self.groups[target]
+            else:
+                return None
+            for name in members:
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def parse_command(self, line):
+        """解析 [@<目标>[+<毫秒>]:]<命令>，返回 (控制器名称列表, 同步延迟, 命令)"""
+        if not line.startswith("@"):
+            return self.groups["all"], SYNC_DELAY_MS, line
+        spec, _, command = line[1:].partition(":")
+        delay = SYNC_DELAY_MS
+        if "+" in spec:
+            spec, delay = spec.split("+", 1)
+            delay = int(delay)
+        return self.resolve_targets(spec), delay, command
+
+    def handle_command(self, line):
+        """处理客户端的一条命令，返回响应文本 (心跳返回 None)"""
+        if line in HEARTBEAT_COMMANDS:
+            return None
+        if line == "FLEET?":
+            return "OK:FLEET:" + ",".join(f"{name}={link.status()}" for name, link in self.links.items())
+
+        try:
+            names, delay, command = self.parse_command(line)
+        except ValueError:
+            return "ERROR:FLEET_PARSE_ERROR"
+        if names is None:
+            return "ERROR:FLEET_UNKNOWN_TARGET"
+        if not names or not command:
+            return "ERROR:FLEET_PARSE_ERROR"
+
+        if len(names) == 1:
+            return self.links[names[0]].request(command)
+
+        if delay > 0 and command not in IMMEDIATE_COMMANDS and not command.startswith("AT:"):
+            # 各控制器在同一时刻执行
+            command = f"AT:{int(time.time() * 1000) + delay}:{command}"
+        futures = [(name, self.pool.submit(self.links[name].request, command)) for name in names]
+        failed = []
+        for name, future in futures:
+            response = future.result()
+            if not response.startswith("OK"):
+                failed.append(f"{name}={response}")
+        if failed:
+            return "ERROR:FLEET:" + ";".join(failed)
+        return f"OK:FLEET:{len(names)}/{len(names)}"
+
+    def check_token(self, line):
+        """校验客户端发送的 AUTH:<令牌>"""
+        prefix, _, token = line.partition(":")
+        return prefix == "AUTH" and hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    def serve_client(self, client):
+        """处理一个客户端连接直到断开 (配置了令牌时第一行必须是 AUTH:<令牌>)"""
+        pending = b""
+        discarding = False  # 超长帧已报错，丢弃到下一个换行为止
+        authenticated = not self.token
+        while self.is_running:
+            data = client.recv(RX_BUFFER_SIZE)
+            if not data:
+                break
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            if discarding and lines:
+                lines.pop(0)
+                discarding = False
+            if discarding:
+                pending = b""
+            elif len(pending) > RX_BUFFER_SIZE:
+                client.sendall(b"ERROR:FRAME_TOO_LONG\n")
+                pending = b""
+                discarding = True
+            for raw in lines:
+                line = raw.decode('utf-8', 'replace').strip()
+                if not line:
+                    continue
+                if not authenticated:
+                    authenticated = self.check_token(line)
+                    if not authenticated:
+                        print("🔒 客户端令牌错误，已断开")
+                        client.sendall(b"ERROR:AUTH_FAILED\n")
+                        return
+                    client.sendall(b"OK:AUTH\n")
+                    continue
+                response = self.handle_command(line)
+                if response is not None:
+                    client.sendall(response.encode('utf-8') + b"\n")
+
+    def run(self):
+        """运行网关主循环 (同一时间只服务一个客户端)"""
+        print("=" * 60)
+        print("🚀 启动多台树莓派遥控器网关")
+        print("=" * 60)
+        if not self.token and not is_loopback_host(GATEWAY_HOST):
+            # 网关会用控制器令牌转发任意命令，对外监听时自身也必须校验令牌
+            print(f"❌ 网关监听 {GATEWAY_HOST} 但未配置令牌，已拒绝启动 (只在本机使用请监听 127.0.0.1)")
+            return
+        for name, link in self.links.items():
+            link.connect()
+
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((GATEWAY_HOST, GATEWAY_PORT))
+        self.server_socket.listen(1)
+        print(f"📡 等待客户端连接: {GATEWAY_HOST}:{GATEWAY_PORT} ({len(self.links)} 台控制器)")
+
+        while self.is_running:
+            try:
+                client, address = self.server_socket.accept()
+            except OSError:
+                break
+            print(f"📱 客户端已连接: {address}")
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.client_socket = client
+            try:
+                self.serve_client(client)
+            except OSError as e:
+                print(f"⚠️ 客户端通信错误: {e}")
+            finally:
+                client.close()
+                self.client_socket = None
+            print("🔌 客户端已断开")
+
+    def cleanup(self):
+        """清理资源"""
+        self.is_running = False
+        for sock in (self.client_socket, self.server_socket):
+            if sock:
+                try:
+                    sock.close()
+                except OSError:
+                    pass
+        for link in self.links.values():
+            link.close()
+        self.pool.shutdown(wait=False)
+        print("🧹 网关已关闭")
+
+    def signal_handler(self, signum, frame):
+        """信号处理器"""
+        print(f"\n🛑 收到信号 {signum}，网关关闭中...")
+        self.cleanup()
+
+
+def main():
+    try:
+        with open(FLEET_CONFIG) as f:
+            config = json.load(f)
+        gateway = FleetGateway(config)
+    except (OSError, ValueError) as e:
+        print(f"❌ 网关配置无效 ({FLEET_CONFIG}): {e}")
+        sys.exit(1)
+
+    signal.signal(signal.SIGINT, gateway.signal_handler)
+    signal.signal(signal.SIGTERM, gateway.signal_handler)
+
+    try:
+        gateway.run()
+    finally:
+        gateway.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -76,6 +76,9 @@ WorkingDirectory=/home/pi
 ExecStart=/usr/bin/python3 /home/pi/raspberry_pi_controller.py
 Restart=always
 RestartSec=5
+# 实时模式 (Environment=RPI_REALTIME=1) 下执行器以 pi 用户切换为 SCHED_FIFO，需要放开实时优先级上限
+LimitRTPRIO=99
+AmbientCapabilities=CAP_SYS_NICE
 
 [Install]
 WantedBy=multi-user.target
@@ -84,10 +87,14 @@ EOF
 # 复制控制脚本到用户目录
 echo "复制控制脚本..."
 cp raspberry_pi_controller.py /home/pi/
+cp bluetooth_pairing_helper.py /home/pi/
+cp fleet_gateway.py /home/pi/
+cp trace_replay.py /home/pi/
+cp command_trace.py /home/pi/
 
 # 设置权限
-sudo chown pi:pi /home/pi/raspberry_pi_controller.py
-sudo chmod +x /home/pi/raspberry_pi_controller.py
+sudo chown pi:pi /home/pi/command_trace.py /home/pi/raspberry_pi_controller.py /home/pi/bluetooth_pairing_helper.py /home/pi/fleet_gateway.py /home/pi/trace_replay.py
+sudo chmod +x /home/pi/raspberry_pi_controller.py /home/pi/bluetooth_pairing_helper.py /home/pi/fleet_gateway.py /home/pi/trace_replay.py
 
 echo "========================================"
 echo "安装完成！"
@@ -106,6 +113,13 @@ echo "2. 启用服务: sudo systemctl enable rpi-controller"
 echo "3. 启动服务: sudo systemctl start rpi-controller"
 echo "4. 查看状态: sudo systemctl status rpi-controller"
 echo "5. 查看日志: sudo journalctl -u rpi-controller -f"
+echo "6. 多台联控: 各控制器设置 RPI_LOCAL_TCP_HOST=<本机网卡地址> RPI_LOCAL_TCP_PORT=8889 RPI_LOCAL_TOKEN=<令牌>，"
+echo "   在网关机器上编写 fleet_config.json (含同一令牌) 后运行 python3 /home/pi/fleet_gateway.py"
+echo "   该端口可执行校准/写文件等命令，只在可信网络上开放"
+echo "   网关默认只监听 127.0.0.1，设置 RPI_GATEWAY_HOST 对外监听时客户端需先发送 AUTH:<令牌>"
+echo "7. 导出命令跟踪: kill -USR1 \$(pgrep -f raspberry_pi_controller.py)，"
+echo "   重放: python3 /home/pi/trace_replay.py /home/pi/traces/<文件> [--max-speed]"
+echo "8. 栈采样: kill -USR2 \$(pgrep -f raspberry_pi_controller.py)，结果在 /home/pi/profiles/*.folded"
 echo ""
 echo "重启系统以确保所有设置生效:"
 echo "sudo reboot"
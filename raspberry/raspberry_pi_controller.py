@@ -9,7 +9,21 @@ import time
 import threading
 import subprocess
 import signal
+import sys
+import socket
 import os
+import gc
+import fcntl
+import termios
+import array
+import bisect
+import heapq
+import hmac
+import re
+import base64
+import mmap
+import struct
+from collections import Counter, OrderedDict, deque
 from gpiozero import Servo, Device
 from gpiozero.pins.pigpio import PiGPIOFactory
 import board
@@ -17,15 +31,484 @@ import busio
 import adafruit_ssd1306
 from PIL import Image, ImageDraw, ImageFont
 import json
+from command_trace import TraceRecorder, TRACE_RX, TRACE_RESP, TRACE_ACTUATE, TRACE_LINK
 
 # 使用 pigpio 作为引脚工厂以获得更精确的 PWM 控制
 Device.pin_factory = PiGPIOFactory()
 
+# 心跳/断链检测配置 (可通过环境变量覆盖)
+# 客户端发送过心跳后，连续 HEARTBEAT_MISS_LIMIT 个间隔无任何数据即判定链路丢失；
+# 未发送心跳的旧版客户端仍沿用 LEGACY_IDLE_TIMEOUT 空闲超时
+HEARTBEAT_INTERVAL = float(os.environ.get("RPI_HEARTBEAT_INTERVAL", "1.5"))  # 秒
+HEARTBEAT_MISS_LIMIT = int(os.environ.get("RPI_HEARTBEAT_MISS_LIMIT", "3"))
+LEGACY_IDLE_TIMEOUT = float(os.environ.get("RPI_LEGACY_IDLE_TIMEOUT", "30.0"))  # 秒
+LINK_LOSS_ACTION = os.environ.get("RPI_LINK_LOSS_ACTION", "center")  # center: 舵机回中 / hold: 保持
+HEARTBEAT_COMMANDS = ("PING", "HB")
+
+# 遥测推送配置: 客户端发送 TELEMETRY:<Hz> 订阅，TELEMETRY:0 取消；无订阅时不启动任何线程
+TELEMETRY_DEFAULT_HZ = float(os.environ.get("RPI_TELEMETRY_HZ", "5"))
+TELEMETRY_MAX_HZ = float(os.environ.get("RPI_TELEMETRY_MAX_HZ", "20"))
+TELEMETRY_RSSI_INTERVAL = float(os.environ.get("RPI_TELEMETRY_RSSI_INTERVAL", "5.0"))  # 秒，hcitool 调用较慢
+CPU_TEMP_PATH = "/sys/class/thermal/thermal_zone0/temp"
+
+# 接收路径配置: 复用预分配缓冲区，调试输出默认关闭 (RPI_VERBOSE=1 开启)
+# 缓冲区需容纳最长的一帧: 整屏 RAW 位图 IMG:0:0:128:8:RAW:<1368 个 base64 字符> 约 1.4KB
+RX_BUFFER_SIZE = int(os.environ.get("RPI_RX_BUFFER_SIZE", "2048"))
+VERBOSE = os.environ.get("RPI_VERBOSE", "0") == "1"
+
+# 预编码的响应与显示文本，热路径上不再格式化/编码字符串
+RESP_SERVO_OK = tuple(tuple(f"OK:SERVO{n}:{a}".encode('utf-8') for a in range(181)) for n in (1, 2))
+RESP_SERVO_FAILED = (b"ERROR:SERVO1_CONTROL_FAILED", b"ERROR:SERVO2_CONTROL_FAILED")
+RESP_DECODE_ERROR = b"ERROR:DECODE_ERROR"
+RESP_FRAME_TOO_LONG = b"ERROR:FRAME_TOO_LONG"
+SERVO_DISPLAY_TEXT = tuple(tuple(f"舵机{n}: {a}°" for a in range(181)) for n in (1, 2))
+FRAME_WHITESPACE = frozenset(b" \t\r\n\0")
+
+# 舵机校准配置: 每个舵机的最小/中位/最大脉宽 (微秒) 及可选的非线性校正点，
+# 启动时预计算查找表，热路径只做一次索引
+CALIBRATION_FILE = os.environ.get(
+    "RPI_CALIBRATION_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "servo_calibration.json"))
+LUT_STEPS_PER_DEGREE = int(os.environ.get("RPI_LUT_STEPS_PER_DEGREE", "10"))
+# 舵机 PWM 的可调范围 (微秒)，校准脉宽必须落在此范围内
+SERVO_PULSE_FRAME = (500, 2500)
+
+# 状态持久化: 舵机目标角度和 OLED 内容以追加日志形式保存，重启时直接恢复，避免舵机跳回中位
+STATE_FILE = os.environ.get(
+    "RPI_STATE_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "controller_state.log"))
+STATE_FLUSH_INTERVAL = float(os.environ.get("RPI_STATE_FLUSH_INTERVAL", "0.2"))  # 秒
+STATE_MAX_BYTES = int(os.environ.get("RPI_STATE_MAX_BYTES", "65536"))  # 超过后压缩为单条快照
+CENTER_ON_EXIT = os.environ.get("RPI_CENTER_ON_EXIT", "0") == "1"  # 1: 退出时回中并显示 Server Closed
+
+# OLED 文本渲染: 字体启动时预渲染为字形图集，排版结果按字符串缓存
+OLED_LINE_HEIGHT = 12
+TEXT_LAYOUT_CACHE_SIZE = int(os.environ.get("RPI_TEXT_LAYOUT_CACHE_SIZE", "64"))
+
+# 长文本显示: 超过一屏时本地定时翻页；跑马灯整行放得下时用 SSD1306 硬件滚动，否则只刷新所在的两页
+OLED_PAGE_INTERVAL = float(os.environ.get("RPI_OLED_PAGE_INTERVAL", "3.0"))  # 秒
+MARQUEE_INTERVAL = float(os.environ.get("RPI_MARQUEE_INTERVAL", "0.05"))  # 秒
+MARQUEE_PAGE = 3  # 跑马灯所在的起始页 (占两页，16 像素高)
+MARQUEE_GAP = 32  # 跑马灯首尾之间的空白像素
+OLED_HW_SCROLL_SPEED = 0x07  # 硬件滚动间隔编码，0x07 为每 2 帧移动一次 (最快)
+
+# 位图/图标: 数据为 SSD1306 页格式 (每字节 8 个纵向像素)，可 RLE 压缩或与当前画面做差分
+ICON_DIR = os.environ.get(
+    "RPI_ICON_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "oled_icons"))
+ICON_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+# 命令优先级通道: 安全/连接控制在接收线程内立即执行；舵机目标由执行器线程按节拍输出 (同一舵机只保留最新目标)；
+# 显示命令优先级最低，由显示线程按顺序处理
+ACTUATOR_TICK = float(os.environ.get("RPI_ACTUATOR_TICK", "0.01"))  # 秒
+DISPLAY_COMMAND_PREFIXES = ("OLED", "IMG:", "ICON")
+
+# 信用流控: 显示通道最多排队 FLOW_WINDOW 条命令，客户端发送 FLOW:ON 后服务端通告剩余信用，
+# 超出窗口的显示命令直接拒绝 (ERROR:BUSY) 并计入 shed 计数
+FLOW_WINDOW = int(os.environ.get("RPI_FLOW_WINDOW", "8"))
+
+# 配对代理作为独立子进程运行 (bluetooth_pairing_helper.py --agent)，通过 stdout 的 JSON 行上报事件，
+# 异常退出后自动重启，重启间隔指数退避
+PAIRING_HELPER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bluetooth_pairing_helper.py")
+PAIRING_RESTART_DELAY = float(os.environ.get("RPI_PAIRING_RESTART_DELAY", "2.0"))  # 秒
+PAIRING_RESTART_MAX_DELAY = 30.0  # 秒
+PAIRING_STABLE_TIME = 60.0  # 秒，运行超过该时间后重置退避间隔
+
+# 实时模式 (RPI_REALTIME=1): 执行器线程独占一个 CPU 核并使用 SCHED_FIFO，
+# 启动后冻结现有对象并关闭自动 GC，改由执行器在节拍空闲时段内分代回收
+REALTIME_MODE = os.environ.get("RPI_REALTIME", "0") == "1"
+REALTIME_CPU = int(os.environ.get("RPI_REALTIME_CPU", str((os.cpu_count() or 1) - 1)))
+REALTIME_PRIORITY = int(os.environ.get("RPI_REALTIME_PRIORITY", "50"))
+GC_SLACK = 0.002  # 秒，本节拍剩余时间超过该值才做回收
+GC_FULL_EVERY = 100  # 每做多少次第 0 代回收做一次完整回收
+JITTER_SAMPLES = 1024  # 节拍抖动统计保留的样本数
+
+# 本机控制接口: 板载程序 (如视觉跟踪) 通过 Unix 域套接字发送与蓝牙相同的换行分帧文本命令，
+# 可选再开一个 TCP 端口；高频目标可直接写共享内存目标块，由执行器每个节拍读取
+LOCAL_SOCKET_PATH = os.environ.get("RPI_LOCAL_SOCKET", "/tmp/rpi_controller.sock")  # 留空则不启用
+LOCAL_TCP_HOST = os.environ.get("RPI_LOCAL_TCP_HOST", "127.0.0.1")
+LOCAL_TCP_PORT = int(os.environ.get("RPI_LOCAL_TCP_PORT", "0"))  # 0 表示不启用
+# TCP 客户端的共享令牌: 连接后第一行必须是 AUTH:<令牌>。TCP 端口可执行校准、写图标等命令，
+# 绑定到非回环地址时必须设置令牌，否则拒绝启动该端口 (Unix 套接字靠文件权限保护，不需要令牌)
+LOCAL_TOKEN = os.environ.get("RPI_LOCAL_TOKEN", "")
+# 只对蓝牙链路有意义的命令 (流控、遥测推送以及蓝牙客户端的时钟偏移估计)
+LOCAL_UNSUPPORTED_COMMANDS = ("FLOW:", "TELEMETRY:", "T:", "SYNC:")
+SHM_TARGET_PATH = os.environ.get("RPI_SHM_TARGETS", "")  # 例如 /dev/shm/rpi_servo_targets，留空则不启用
+# 共享内存布局 (小端): u64 序号 + 两个 f64 角度。写入方先把序号加一 (奇数表示写入中)，
+# 写完角度后再加一；角度为 NaN 表示该舵机不更新
+SHM_SEQ = struct.Struct("<Q")
+SHM_ANGLES = struct.Struct("<2d")
+SHM_SIZE = SHM_SEQ.size + SHM_ANGLES.size
+
+# 定时执行: AT:<unix_ms>:<命令> 在指定的系统时间由执行器线程执行，供网关向多台设备同步下发
+# (各设备需 NTP 同步时钟)；急停和链路丢失会丢弃尚未执行的定时命令
+SCHEDULE_MAX_AHEAD = float(os.environ.get("RPI_SCHEDULE_MAX_AHEAD", "10.0"))  # 秒
+SCHEDULE_MAX_PENDING = int(os.environ.get("RPI_SCHEDULE_MAX_PENDING", "64"))
+
+# 带时间戳的命令: T:<客户端毫秒>:<命令> 按客户端发送时刻的间隔执行，不受链路抖动影响。
+# 时钟偏移在握手 (PING:<毫秒>/HELLO:<毫秒>) 和 SYNC:<毫秒> 时估计，之后取每帧 "到达时间 - 客户端时间"
+# 的最小值 (最快一次传输) 持续修正；执行时间 = 客户端时间 + 偏移 + 播放缓冲
+PLAYOUT_DELAY = float(os.environ.get("RPI_PLAYOUT_DELAY_MS", "60")) / 1000.0  # 秒
+CLOCK_DRIFT = 100e-6  # 允许的时钟漂移率，偏移估计按此速度上浮以跟随漂移
+CLOCK_MAX_STEP = 1.0  # 秒，与当前估计相差更大的样本视为异常 (如客户端时钟跳变)，不参与估计
+CLOCK_RESYNC_SAMPLES = 5  # 连续这么多个异常样本说明客户端时钟确实跳变，以最新样本重新估计
+
+# 命令跟踪: 常开的定长二进制环形缓冲区 (格式见 command_trace.py)，记录收到的帧、响应和舵机输出，
+# TRACE_DUMP 命令或 SIGUSR1 时写盘，可用 trace_replay.py 在模拟硬件上重放
+TRACE_RECORDS = int(os.environ.get("RPI_TRACE_RECORDS", "4096"))
+TRACE_DIR = os.environ.get(
+    "RPI_TRACE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "traces"))
+
+# 采样分析: PROFILE:<秒> 命令或 SIGUSR2 启动一次限时的栈采样 (墙钟时间，包含阻塞中的线程)，
+# 结果以折叠栈格式 (.folded) 写盘，可直接交给 flamegraph.pl / speedscope 生成火焰图
+PROFILE_DIR = os.environ.get(
+    "RPI_PROFILE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "profiles"))
+PROFILE_INTERVAL = float(os.environ.get("RPI_PROFILE_INTERVAL_MS", "5")) / 1000.0  # 秒
+PROFILE_SIGNAL_SECONDS = float(os.environ.get("RPI_PROFILE_SIGNAL_SECONDS", "30"))  # SIGUSR2 触发时的采样时长
+PROFILE_MAX_SECONDS = 300
+
+# 中文到英文的简单映射 (OLED 只能显示 ASCII)
+CHINESE_TO_ENGLISH = {
+    "等待连接": "Waiting...",
+    "蓝牙等待连接": "BT Waiting",
+    "已连接": "Connected",
+    "蓝牙已连接": "BT Connected",
+    "蓝牙已断开": "BT Disconnected",
+    "连接已断开": "Disconnected",
+    "舵机": "Servo",
+    "服务器已关闭": "Server Closed",
+    "温度": "Temp",
+    "时间": "Time",
+    "状态": "Status",
+    "正常": "Normal"
+}
+# 长词优先匹配，一次扫描完成全部替换
+CHINESE_PATTERN = re.compile("|".join(
+    re.escape(word) for word in sorted(CHINESE_TO_ENGLISH, key=len, reverse=True)))
+
+
+def rle_decode(data, expected_length):
+    """解码 (次数, 字节值) 成对的游程编码"""
+    if len(data) % 2:
+        raise ValueError("RLE data must contain (count, value) pairs")
+    out = bytearray()
+    for i in range(0, len(data), 2):
+        out.extend(data[i + 1:i + 2] * data[i])
+    if len(out) != expected_length:
+        raise ValueError(f"RLE decoded {len(out)} bytes, expected {expected_length}")
+    return out
+
+
+def rle_encode(data):
+    """游程编码 (每段最长 255)，供脚本生成图标数据"""
+    out = bytearray()
+    i = 0
+    while i < len(data):
+        run = 1
+        while i + run < len(data) and run < 255 and data[i + run] == data[i]:
+            run += 1
+        out.append(run)
+        out.append(data[i])
+        i += run
+    return bytes(out)
+
+
+class AsciiTable(dict):
+    """str.translate 用的转换表: ASCII 原样保留，其他字符删除 (首次遇到时缓存)"""
+    
+    def __missing__(self, code):
+        value = code if code < 128 else None
+        self[code] = value
+        return value
+
+
+ASCII_TABLE = AsciiTable()
+
+class ServoCalibration:
+    """单个舵机的校准参数，负责生成角度 -> servo 值的查找表"""
+    
+    def __init__(self, min_pulse=1000, center_pulse=1500, max_pulse=2000, curve=None):
+        self.min_pulse = min_pulse
+        self.center_pulse = center_pulse
+        self.max_pulse = max_pulse
+        # 非线性校正点: [[角度, 脉宽], ...]，与三个端点一起做分段线性插值
+        self.curve = [list(point) for point in (curve or [])]
+        self.validate()
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("min_pulse", 1000), data.get("center_pulse", 1500),
+                   data.get("max_pulse", 2000), data.get("curve"))
+    
+    def to_dict(self):
+        return {
+            "min_pulse": self.min_pulse,
+            "center_pulse": self.center_pulse,
+            "max_pulse": self.max_pulse,
+            "curve": self.curve
+        }
+    
+    def validate(self):
+        """检查脉宽是否在 PWM 可调范围内，且按角度排序后脉宽严格递增 (否则查找表会折返)"""
+        if any(len(point) != 2 for point in self.curve):
+            raise ValueError(f"curve points must be [angle, pulse] pairs: {self.curve}")
+        pulses = [self.min_pulse, self.center_pulse, self.max_pulse] + [p for _, p in self.curve]
+        angles = [a for a, _ in self.curve]
+        for value in pulses + angles:
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f"calibration value {value!r} is not a number")
+        for pulse in pulses:
+            if not SERVO_PULSE_FRAME[0] <= pulse <= SERVO_PULSE_FRAME[1]:
+                raise ValueError(f"pulse {pulse}us out of range {SERVO_PULSE_FRAME}")
+        for angle in angles:
+            if not 0 <= angle <= 180:
+                raise ValueError(f"curve angle {angle} out of range")
+        points = self.control_points()
+        for (angle_a, pulse_a), (angle_b, pulse_b) in zip(points, points[1:]):
+            if pulse_b <= pulse_a:
+                raise ValueError(f"pulse {pulse_b}us at {angle_b}° is not above {pulse_a}us at {angle_a}°")
+    
+    def control_points(self):
+        """返回按角度排序的 (角度, 脉宽) 控制点"""
+        points = {0: self.min_pulse, 90: self.center_pulse, 180: self.max_pulse}
+        for angle, pulse in self.curve:
+            points[angle] = pulse
+        return sorted(points.items())
+    
+    def build_lut(self):
+        """预计算查找表: 下标为 角度*LUT_STEPS_PER_DEGREE，值为 gpiozero Servo.value (-1 到 1)"""
+        points = self.control_points()
+        angles = [a for a, _ in points]
+        frame_mid = (SERVO_PULSE_FRAME[0] + SERVO_PULSE_FRAME[1]) / 2.0
+        frame_half = (SERVO_PULSE_FRAME[1] - SERVO_PULSE_FRAME[0]) / 2.0
+        
+        lut = array.array('d', bytes(8 * (180 * LUT_STEPS_PER_DEGREE + 1)))
+        for i in range(len(lut)):
+            angle = i / LUT_STEPS_PER_DEGREE
+            k = min(max(bisect.bisect_right(angles, angle), 1), len(points) - 1)
+            a0, p0 = points[k - 1]
+            a1, p1 = points[k]
+            pulse = p0 + (p1 - p0) * (angle - a0) / (a1 - a0)
+            lut[i] = max(-1.0, min(1.0, (pulse - frame_mid) / frame_half))
+        return lut
+
+
+class StateStore:
+    """崩溃安全的追加式状态日志
+    
+    每行一条 JSON 增量记录，加载时按顺序合并，末尾被截断的半行直接忽略。
+    热路径只修改内存中的字典，后台线程按 STATE_FLUSH_INTERVAL 合并写盘并 fsync。
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.state = {}
+        self.dirty = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.flush_thread = None
+        self.torn_tail = False
+        self.load()
+    
+    def load(self):
+        """读取日志并合并为当前状态"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self.torn_tail = not line.endswith("\n")
+                    try:
+                        self.state.update(json.loads(line))
+                    except ValueError:
+                        # 断电时写了一半的记录
+                        continue
+            print(f"💾 已恢复状态: {self.state}")
+        except FileNotFoundError:
+            print("💾 未找到状态文件，使用默认状态")
+        except Exception as e:
+            print(f"⚠️ 读取状态文件失败: {e}")
+    
+    def get(self, key, default=None):
+        return self.state.get(key, default)
+    
+    def set(self, key, value):
+        """记录状态变化 (只写内存，由后台线程落盘)"""
+        with self.lock:
+            self.state[key] = value
+            self.dirty[key] = value
+    
+    def start(self):
+        """启动后台写盘线程"""
+        self.flush_thread = threading.Thread(target=self._flush_worker, name="state-flush", daemon=True)
+        self.flush_thread.start()
+    
+    def _flush_worker(self):
+        while not self.stop_event.wait(STATE_FLUSH_INTERVAL):
+            self.flush()
+    
+    def flush(self):
+        """把未落盘的变化追加到日志，日志过大时压缩"""
+        with self.lock:
+            if not self.dirty:
+                return
+            record = json.dumps(self.dirty, ensure_ascii=False, separators=(",", ":"))
+            self.dirty = {}
+            snapshot = dict(self.state)
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                if self.torn_tail:
+                    # 让新记录从新的一行开始，不与残缺记录粘连
+                    f.write("\n")
+                    self.torn_tail = False
+                f.write(record + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            if size > STATE_MAX_BYTES:
+                self.compact(snapshot)
+        except Exception as e:
+            print(f"⚠️ 状态写盘失败: {e}")
+    
+    def compact(self, snapshot):
+        """用单条完整快照替换日志 (临时文件 + 原子替换)"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+    
+    def close(self):
+        """停止后台线程并写入剩余变化"""
+        self.stop_event.set()
+        if self.flush_thread:
+            self.flush_thread.join(timeout=2)
+        self.flush()
+
+
+def reserve_realtime_cpu():
+    """实时模式下让普通线程避开实时核 (之后创建的线程会继承这个 CPU 亲和性)"""
+    try:
+        others = os.sched_getaffinity(0) - {REALTIME_CPU}
+        if others:
+            os.sched_setaffinity(0, others)
+            print(f"⏱️ 实时模式: CPU {REALTIME_CPU} 预留给执行器，其余线程使用 {sorted(others)}")
+    except Exception as e:
+        print(f"⚠️ 设置CPU亲和性失败: {e}")
+
+
+class GlyphTextRenderer:
+    """基于预渲染字形图集的 SSD1306 文本渲染器
+    
+    启动时把 ASCII 可打印字符逐个光栅化，每列存成一个 16 位整数 (bit n 对应第 n 行像素)，
+    即两页高的 SSD1306 页格式。渲染时直接把列数据移位后或进帧缓冲，
+    完整帧按字符串缓存，重复文本只需一次内存拷贝。
+    """
+    
+    FIRST_CHAR = 32
+    LAST_CHAR = 126
+    GLYPH_HEIGHT = 16
+    
+    def __init__(self, width, height, font):
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.columns = array.array('H')
+        self.offsets = array.array('H', bytes(2 * 128))
+        self.widths = array.array('B', bytes(128))
+        self.layout_cache = OrderedDict()
+        self.build_atlas(font)
+    
+    def build_atlas(self, font):
+        """光栅化全部 ASCII 可打印字符"""
+        for code in range(self.FIRST_CHAR, self.LAST_CHAR + 1):
+            char = chr(code)
+            if hasattr(font, "getlength"):
+                char_width = int(round(font.getlength(char)))
+            else:
+                char_width = font.getsize(char)[0]
+            
+            image = Image.new("1", (max(char_width, 1), self.GLYPH_HEIGHT))
+            ImageDraw.Draw(image).text((0, 0), char, font=font, fill=1)
+            pixels = image.load()
+            
+            self.offsets[code] = len(self.columns)
+            self.widths[code] = char_width
+            for x in range(char_width):
+                column = 0
+                for y in range(self.GLYPH_HEIGHT):
+                    if pixels[x, y]:
+                        column |= 1 << y
+                self.columns.append(column)
+    
+    def render(self, text):
+        """返回文本对应的整帧数据 (页格式 bytes)，命中缓存时不做任何排版"""
+        frame = self.layout_cache.get(text)
+        if frame is not None:
+            self.layout_cache.move_to_end(text)
+            return frame
+        
+        buf = bytearray(self.width * self.pages)
+        y_offset = 0
+        for line in text.split('\n'):
+            if y_offset >= self.height - OLED_LINE_HEIGHT:
+                break
+            self.blit_line(buf, line, y_offset)
+            y_offset += OLED_LINE_HEIGHT
+        
+        frame = bytes(buf)
+        self.layout_cache[text] = frame
+        if len(self.layout_cache) > TEXT_LAYOUT_CACHE_SIZE:
+            self.layout_cache.popitem(last=False)
+        return frame
+    
+    def blit_line(self, buf, line, y):
+        """把一行文本写入帧缓冲，y 可以不对齐到页边界"""
+        width = self.width
+        columns = self.columns
+        shift = y & 7
+        base = (y >> 3) * width
+        has_page2 = (y >> 3) + 1 < self.pages
+        has_page3 = (y >> 3) + 2 < self.pages
+        x = 0
+        for char in line:
+            code = ord(char)
+            if code < self.FIRST_CHAR or code > self.LAST_CHAR:
+                continue
+            offset = self.offsets[code]
+            for i in range(self.widths[code]):
+                if x >= width:
+                    return
+                column = columns[offset + i] << shift
+                if column:
+                    buf[base + x] |= column & 0xFF
+                    if has_page2:
+                        buf[base + width + x] |= (column >> 8) & 0xFF
+                    if has_page3:
+                        buf[base + 2 * width + x] |= (column >> 16) & 0xFF
+                x += 1
+
+
 class RaspberryPiController:
     def __init__(self):
-        # 舵机初始化 (GPIO 引脚)
-        self.servo1 = Servo(18)  # GPIO 18
-        self.servo2 = Servo(19)  # GPIO 19
+        # 恢复上次运行保存的状态
+        self.state_store = StateStore(STATE_FILE)
+        
+        # 加载校准参数并预计算查找表
+        self.calibrations = self.load_calibration()
+        self.servo_luts = [cal.build_lut() for cal in self.calibrations]
+        
+        # 舵机初始化 (GPIO 引脚)，PWM 范围放宽到 SERVO_PULSE_FRAME，实际端点由校准决定；
+        # 直接以上次的角度作为初始值输出，重启时舵机不会跳动
+        self.servo_angles = self.restore_servo_angles()
+        min_width = SERVO_PULSE_FRAME[0] / 1000000.0
+        max_width = SERVO_PULSE_FRAME[1] / 1000000.0
+        self.servo1 = Servo(18, initial_value=self.angle_to_value(0, self.servo_angles[0]),
+                            min_pulse_width=min_width, max_pulse_width=max_width)  # GPIO 18
+        self.servo2 = Servo(19, initial_value=self.angle_to_value(1, self.servo_angles[1]),
+                            min_pulse_width=min_width, max_pulse_width=max_width)  # GPIO 19
+        self.servos = (self.servo1, self.servo2)
         
         # OLED 显示屏初始化 (I2C)
         self.i2c = busio.I2C(board.SCL, board.SDA)
@@ -34,16 +517,113 @@ class RaspberryPiController:
         # 蓝牙服务器设置
         self.server_socket = None
         self.client_socket = None
+        self.client_address = None
+        self.client_stream = None
         self.is_running = True
+        self.send_lock = threading.Lock()
+        
+        # 接收缓冲区 (整个进程生命周期内复用)
+        self.rx_buffer = bytearray(RX_BUFFER_SIZE)
+        self.rx_view = memoryview(self.rx_buffer)
+        
+        # 常开的命令跟踪
+        self.trace = TraceRecorder(TRACE_RECORDS)
+        
+        # 采样分析状态
+        self.profile_thread = None
+        self.profile_stop = threading.Event()
+        
+        # 命令优先级通道
+        self.lanes_active = False
+        self.motion_lock = threading.Lock()
+        self.motion_targets = [None, None]
+        self.actuator_wake = threading.Event()
+        self.actuator_thread = None
+        self.display_queue = deque()
+        self.display_pending = 0  # 队列中的显示命令数 (不含状态文本)，在 display_cond 下更新
+        self.display_cond = threading.Condition()
+        self.display_thread = None
+        
+        # 执行器节拍抖动统计 (秒)
+        self.jitter_samples = array.array('d', bytes(8 * JITTER_SAMPLES))
+        self.jitter_index = 0
+        self.jitter_count = 0
+        self.gc_collections = 0
+        
+        # 流控状态与计数
+        self.flow_enabled = False
+        # 响应是否以换行结尾: 开启流控或订阅遥测后，响应与 CREDIT/TLM 帧共用连接，需要换行分隔 (本次连接内保持)
+        self.line_responses = False
+        self.stats = {"received": 0, "coalesced": 0, "shed": 0, "display_done": 0,
+                      "scheduled": 0, "late": 0}
+        
+        # 定时命令 (到期的 monotonic 时间, 序号, 命令) 小顶堆
+        self.schedule = []
+        self.schedule_lock = threading.Lock()
+        self.schedule_seq = 0
+        
+        # 客户端时钟偏移估计 (本地 monotonic 秒 - 客户端秒，含最小单程延迟)
+        self.clock_offset = None
+        self.clock_sync_time = 0.0
+        self.clock_outliers = 0
+        
+        # 命令计数 (供遥测使用)
+        self.command_count = 0
+        
+        # 遥测订阅状态
+        self.telemetry_hz = 0
+        self.telemetry_thread = None
+        self.telemetry_stop = threading.Event()
         
         # 配对助手设置
         self.pairing_process = None
         self.pairing_active = False
+        self.pairing_stop = threading.Event()
+        self.pairing_thread = None
         self.pin_code = "0000"
         
-        # 初始化显示
+        # 本机控制接口
+        self.local_servers = []
+        self.local_clients = set()
+        self.shm_file = None
+        self.shm_map = None
+        self.shm_seq = 0
+        
+        # 预渲染字形图集，失败时退回 PIL 逐次绘制
+        self.text_renderer = None
+        self.current_frame = None
+        self.display_lock = threading.RLock()
+        self.framebuffer_offset = len(self.oled.buffer) - self.oled.width * self.oled.height // 8
+        # 局部刷新用的发送缓冲区 (首字节为 I2C 数据控制字节)
+        self.page_tx = bytearray(1 + self.oled.width * self.oled.height // 8)
+        self.page_tx[0] = 0x40
+        
+        # 已缓存的图标 (id -> (宽度, 页数, 页格式数据))
+        self.icons = {}
+        
+        # 翻页/跑马灯状态
+        self.scroll_thread = None
+        self.scroll_stop = threading.Event()
+        self.hw_scroll_active = False
+        try:
+            self.text_renderer = GlyphTextRenderer(self.oled.width, self.oled.height,
+                                                   ImageFont.load_default())
+        except Exception as e:
+            print(f"⚠️ 字形图集生成失败，使用 PIL 渲染: {e}")
+        
+        # 初始化显示 (有保存的内容时直接恢复)
         self.clear_oled()
-        self.display_text("Waiting...")
+        saved_text = self.state_store.get("oled")
+        saved_mode = self.state_store.get("oled_mode")
+        if saved_mode == "image" and self.state_store.get("oled_frame"):
+            self.restore_frame(self.state_store.get("oled_frame"))
+        elif saved_text and saved_mode == "marquee":
+            self.start_marquee(saved_text)
+        elif saved_text:
+            self.show_long_text(saved_text)
+        else:
+            self.display_text("Waiting...")
+        self.state_store.start()
         
     def setup_bluetooth_server(self):
         """设置蓝牙服务器"""
@@ -162,17 +742,19 @@ class RaspberryPiController:
             print(f"Failed to ensure discoverability: {e}")
     
     def start_pairing_agent(self):
-        """启动配对代理，自动处理PIN码确认"""
+        """启动配对代理子进程 (由监管线程负责重启)，自动处理PIN码确认"""
         if self.pairing_active:
             return
             
         try:
             print("🔑 启动配对代理...")
             self.pairing_active = True
+            self.pairing_stop.clear()
             
-            # 启动后台线程处理配对
-            pairing_thread = threading.Thread(target=self._pairing_agent_worker, daemon=True)
-            pairing_thread.start()
+            # 监管线程大部分时间阻塞在管道读取上，不会占用 GIL
+            self.pairing_thread = threading.Thread(target=self._pairing_supervisor, name="pairing-supervisor",
+                                                   daemon=True)
+            self.pairing_thread.start()
             
             print("✅ 配对代理已启动，可以自动处理PIN码确认")
             
@@ -180,133 +762,66 @@ class RaspberryPiController:
             print(f"❌ 配对代理启动失败: {e}")
             self.pairing_active = False
     
-    def _pairing_agent_worker(self):
-        """配对代理工作线程"""
-        try:
-            # 启动bluetoothctl进程
-            self.pairing_process = subprocess.Popen(
-                ["sudo", "bluetoothctl"],
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1,
-                universal_newlines=True
-            )
-            
-            # 发送初始配置命令
-            commands = [
-                "agent on",
-                "default-agent",
-                "pairable on",
-                "discoverable on"
-            ]
-            
-            for cmd in commands:
-                self.pairing_process.stdin.write(cmd + "\n")
-                self.pairing_process.stdin.flush()
-                time.sleep(0.5)
-            
-            print("🔵 配对代理监听配对请求...")
-            self.display_text("Pairing Ready\nWaiting...")
+    def _pairing_supervisor(self):
+        """配对代理监管线程: 启动子进程、转发事件、异常退出后重启"""
+        delay = PAIRING_RESTART_DELAY
+        while self.pairing_active:
+            started = time.monotonic()
+            try:
+                self.pairing_process = subprocess.Popen(
+                    [sys.executable, PAIRING_HELPER, "--agent", "--pin", self.pin_code],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE,
+                    text=True,
+                    bufsize=1
+                )
+                print(f"🔵 配对代理进程已启动 (PID {self.pairing_process.pid})")
+                
+                for line in self.pairing_process.stdout:
+                    self.handle_pairing_event(line)
+                code = self.pairing_process.wait()
+            except Exception as e:
+                print(f"❌ 配对代理进程错误: {e}")
+                code = None
             
-            # 监听配对请求
-            while self.pairing_active and self.pairing_process.poll() is None:
-                try:
-                    line = self.pairing_process.stdout.readline()
-                    if not line:
-                        break
-                        
-                    line = line.strip()
-                    if line:
-                        print(f"📟 {line}")
-                        
-                        # 处理各种配对请求
-                        if "Request PIN code" in line:
-                            print(f"🔑 收到PIN码请求，发送: {self.pin_code}")
-                            self.pairing_process.stdin.write(f"{self.pin_code}\n")
-                            self.pairing_process.stdin.flush()
-                            self.display_text(f"PIN: {self.pin_code}\nSent")
-                            
-                        elif "Confirm passkey" in line:
-                            # 提取密钥
-                            import re
-                            passkey_match = re.search(r'Confirm passkey (\d+)', line)
-                            if passkey_match:
-                                passkey = passkey_match.group(1)
-                                print(f"🔑 收到密钥确认请求: {passkey}")
-                                print("📱 请在手机上确认相同的密钥!")
-                                self.display_text(f"Confirm:\n{passkey}")
-                                
-                            print("✅ 自动确认配对密钥")
-                            self.pairing_process.stdin.write("yes\n")
-                            self.pairing_process.stdin.flush()
-                            
-                        elif "Request confirmation" in line:
-                            print("🔑 收到配对确认请求")
-                            print("✅ 自动确认配对")
-                            self.pairing_process.stdin.write("yes\n")
-                            self.pairing_process.stdin.flush()
-                            self.display_text("Confirming\nPairing...")
-                            
-                        elif "[agent] Confirm passkey" in line:
-                            # 处理代理确认请求
-                            import re
-                            passkey_match = re.search(r'Confirm passkey (\d+)', line)
-                            if passkey_match:
-                                passkey = passkey_match.group(1)
-                                print(f"🔑 代理密钥确认: {passkey}")
-                                print("📱 请在手机上确认相同的密钥!")
-                                self.display_text(f"Key: {passkey}\nConfirm on phone")
-                            self.pairing_process.stdin.write("yes\n")
-                            self.pairing_process.stdin.flush()
-                            
-                        elif "Authorize service" in line:
-                            print("✅ 授权服务")
-                            self.pairing_process.stdin.write("yes\n")
-                            self.pairing_process.stdin.flush()
-                            self.display_text("Service\nAuthorized")
-                            
-                        elif "Pairing successful" in line:
-                            print("🎉 配对成功！")
-                            self.display_text("Pairing\nSuccess!")
-                            time.sleep(2)  # 显示成功信息2秒
-                            
-                        elif "Failed to pair" in line:
-                            print("❌ 配对失败")
-                            self.display_text("Pairing\nFailed")
-                            
-                        elif "Request canceled" in line:
-                            print("⚠️  配对请求被取消")
-                            self.display_text("Pairing\nCanceled")
-                            
-                        elif "NEW" in line and "Device" in line:
-                            print("📱 发现新设备尝试配对")
-                            self.display_text("Device Found\nPairing...")
-                            
-                except Exception as e:
-                    if self.pairing_active:
-                        print(f"配对代理读取错误: {e}")
-                    break
-                    
-        except Exception as e:
-            print(f"❌ 配对代理错误: {e}")
-        finally:
-            self.stop_pairing_agent()
+            if not self.pairing_active:
+                break
+            if time.monotonic() - started > PAIRING_STABLE_TIME:
+                delay = PAIRING_RESTART_DELAY
+            print(f"⚠️ 配对代理进程退出 (返回码 {code})，{delay:.1f}秒后重启")
+            self.post_display("Pairing Agent\nRestarting...")
+            if self.pairing_stop.wait(delay):
+                break
+            delay = min(delay * 2, PAIRING_RESTART_MAX_DELAY)
+    
+    def handle_pairing_event(self, line):
+        """处理配对代理子进程上报的一行 JSON 事件"""
+        try:
+            event = json.loads(line)
+        except ValueError:
+            print(f"📟 {line.rstrip()}")
+            return
+        if event.get("event") == "display":
+            self.post_display(event.get("text", ""))
     
     def stop_pairing_agent(self):
         """停止配对代理"""
         self.pairing_active = False
-        if self.pairing_process:
+        self.pairing_stop.set()
+        process = self.pairing_process
+        if process:
             try:
-                self.pairing_process.terminate()
-                self.pairing_process.wait(timeout=5)
+                process.terminate()
+                process.wait(timeout=5)
             except:
                 try:
-                    self.pairing_process.kill()
+                    process.kill()
                 except:
                     pass
             self.pairing_process = None
+        if self.pairing_thread and self.pairing_thread is not threading.current_thread():
+            self.pairing_thread.join(timeout=2)
+        self.pairing_thread = None
         print("🔑 配对代理已停止")
     
     def check_bluetooth_adapter(self):
@@ -431,6 +946,7 @@ class RaspberryPiController:
             self.server_socket.settimeout(None)  # 无超时，持续等待
             
             self.client_socket, client_info = self.server_socket.accept()
+            self.client_address = client_info[0]
             print(f"✅ 接受来自 {client_info} 的连接")
             print(f"📱 连接设备: {client_info[0]}")
             
@@ -451,6 +967,12 @@ class RaspberryPiController:
                         handshake_msg = handshake_data.decode('utf-8').strip()
                         print(f"📥 收到握手消息: '{handshake_msg}'")
                         
+                        # 握手可携带客户端时间 (PING:<毫秒>)，用于估计时钟偏移
+                        handshake_msg, _, client_ms = handshake_msg.partition(":")
+                        if client_ms.isdigit():
+                            offset = self.sync_clock(int(client_ms))
+                            print(f"⏱️ 客户端时钟偏移初始估计: {offset * 1000:.1f}ms")
+                        
                         if handshake_msg in ["PING", "HELLO", "CONNECT"]:
                             # 发送握手确认
                             confirm_msg = "HANDSHAKE_OK"
@@ -471,7 +993,10 @@ class RaspberryPiController:
                 print(f"⚠️ 连接验证失败: {verify_error}")
                 print("🔄 仍然尝试继续连接")
                 
-            self.display_text(f"Connected:\n{client_info[0][:12]}")
+            # 之后的收发都走标准库 socket，以便使用 recv_into
+            self.client_stream = self.wrap_client_socket(self.client_socket)
+            
+            self.post_display(f"Connected:\n{client_info[0][:12]}")
             print("🎉 连接建立完成！")
             return True
             
@@ -484,30 +1009,366 @@ class RaspberryPiController:
     
     def control_servo1(self, angle):
         """控制舵机1"""
-        try:
-            # 将角度 (0-180) 转换为 servo 值 (-1 到 1)
-            servo_value = (angle - 90) / 90.0
-            self.servo1.value = max(-1, min(1, servo_value))
-            print(f"舵机1 设置到 {angle}°")
-            return True
-        except Exception as e:
-            print(f"舵机1 控制错误: {e}")
-            return False
+        return self.set_servo_angle(0, angle)
     
     def control_servo2(self, angle):
         """控制舵机2"""
+        return self.set_servo_angle(1, angle)
+    
+    def set_servo_angle(self, index, angle):
+        """通过校准查找表把角度 (0-180) 转换为 servo 值并输出"""
         try:
-            # 将角度 (0-180) 转换为 servo 值 (-1 到 1)
-            servo_value = (angle - 90) / 90.0
-            self.servo2.value = max(-1, min(1, servo_value))
-            print(f"舵机2 设置到 {angle}°")
+            self.servos[index].value = self.angle_to_value(index, angle)
+            self.servo_angles[index] = angle
+            self.trace.record(TRACE_ACTUATE, index, angle)
+            self.state_store.set("servo", self.servo_angles)
+            if VERBOSE:
+                print(f"舵机{index + 1} 设置到 {angle}°")
             return True
         except Exception as e:
-            print(f"舵机2 控制错误: {e}")
+            print(f"舵机{index + 1} 控制错误: {e}")
             return False
     
+    def restore_servo_angles(self):
+        """读取上次保存的舵机角度，记录损坏或越界时使用默认的 [90, 90]"""
+        angles = self.state_store.get("servo")
+        if isinstance(angles, list) and len(angles) == 2 and all(
+                isinstance(angle, (int, float)) and not isinstance(angle, bool) and 0 <= angle <= 180
+                for angle in angles):
+            return list(angles)
+        if angles is not None:
+            print(f"⚠️ 保存的舵机角度无效 ({angles})，使用默认角度 [90, 90]")
+        return [90, 90]
+    
+    def angle_to_value(self, index, angle):
+        """查表得到角度对应的 servo 值"""
+        return self.servo_luts[index][int(angle * LUT_STEPS_PER_DEGREE + 0.5)]
+    
+    def load_calibration(self):
+        """从文件加载舵机校准参数，缺失或损坏时使用默认值"""
+        calibrations = [ServoCalibration(), ServoCalibration()]
+        try:
+            with open(CALIBRATION_FILE) as f:
+                profile = json.load(f)
+            for i in range(2):
+                data = profile.get(f"servo{i + 1}")
+                if data:
+                    calibrations[i] = ServoCalibration.from_dict(data)
+            print(f"🎯 已加载舵机校准: {CALIBRATION_FILE}")
+        except FileNotFoundError:
+            print("🎯 未找到舵机校准文件，使用默认脉宽 1000-1500-2000us")
+        except Exception as e:
+            print(f"⚠️ 舵机校准文件无效，使用默认值: {e}")
+        return calibrations
+    
+    def save_calibration(self):
+        """保存舵机校准参数 (先写临时文件再替换，避免写一半断电)"""
+        profile = {f"servo{i + 1}": cal.to_dict() for i, cal in enumerate(self.calibrations)}
+        tmp_path = CALIBRATION_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(profile, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, CALIBRATION_FILE)
+    
+    def calibrate_servo(self, index, calibration):
+        """更新舵机校准参数，重建查找表并持久化"""
+        self.calibrations[index] = calibration
+        self.servo_luts[index] = calibration.build_lut()
+        self.save_calibration()
+        # 按新的映射重新输出当前角度
+        self.set_servo_angle(index, self.servo_angles[index])
+    
+    def parse_angle(self, angle_str):
+        """解析角度，支持小数 (查找表分辨率为 1/LUT_STEPS_PER_DEGREE 度)"""
+        if "." in angle_str:
+            return float(angle_str)
+        return int(angle_str)
+    
     def display_text(self, text):
-        """在OLED上显示文本"""
+        """在OLED上显示文本 (会结束正在进行的翻页/跑马灯)"""
+        self.stop_scrolling()
+        self.render_text(text)
+    
+    def render_text(self, text):
+        """把文本渲染到整屏并刷新"""
+        if self.text_renderer is None:
+            return self.display_text_pil(text)
+        try:
+            # 将中文转换为英文显示，避免编码问题
+            frame = self.text_renderer.render(self.convert_to_ascii(text))
+            with self.display_lock:
+                if frame is self.current_frame:
+                    # 屏幕上已经是这一帧，无需再占用 I2C 总线
+                    return
+                self.oled.buffer[self.framebuffer_offset:] = frame
+                self.oled.show()
+                self.current_frame = frame
+        except Exception as e:
+            print(f"OLED 显示错误: {e}")
+    
+    def char_width(self, char):
+        """字符显示宽度 (像素)"""
+        code = ord(char)
+        if self.text_renderer is None:
+            return 6
+        if code < GlyphTextRenderer.FIRST_CHAR or code > GlyphTextRenderer.LAST_CHAR:
+            return 0
+        return self.text_renderer.widths[code]
+    
+    def max_text_lines(self):
+        """一屏能显示的行数"""
+        return (self.oled.height - OLED_LINE_HEIGHT - 1) // OLED_LINE_HEIGHT + 1
+    
+    def wrap_text(self, text):
+        """按屏幕宽度自动换行 (优先在空格处断开，超长单词强制截断)"""
+        width = self.oled.width
+        lines = []
+        for paragraph in text.split('\n'):
+            line = ""
+            line_width = 0
+            for word in paragraph.split(' '):
+                word_width = sum(self.char_width(c) for c in word)
+                space_width = self.char_width(' ') if line else 0
+                if line_width + space_width + word_width <= width:
+                    line = f"{line} {word}" if line else word
+                    line_width += space_width + word_width
+                    continue
+                if line:
+                    lines.append(line)
+                line, line_width = "", 0
+                for char in word:
+                    char_width = self.char_width(char)
+                    if line_width + char_width > width:
+                        lines.append(line)
+                        line, line_width = "", 0
+                    line += char
+                    line_width += char_width
+            lines.append(line)
+        return lines
+    
+    def show_long_text(self, text):
+        """显示任意长度文本: 自动换行，超过一屏时在本地定时翻页，返回页数"""
+        lines = self.wrap_text(self.convert_to_ascii(text))
+        max_lines = self.max_text_lines()
+        if len(lines) <= max_lines:
+            self.display_text('\n'.join(lines))
+            return 1
+        
+        pages = ['\n'.join(lines[i:i + max_lines]) for i in range(0, len(lines), max_lines)]
+        self.stop_scrolling()
+        self.scroll_stop.clear()
+        self.scroll_thread = threading.Thread(target=self._pager_worker, args=(pages,), name="oled-pager",
+                                              daemon=True)
+        self.scroll_thread.start()
+        return len(pages)
+    
+    def _pager_worker(self, pages):
+        """翻页线程: 每页的帧只排版一次，之后循环只有整帧拷贝和一次 I2C 推送"""
+        index = 0
+        while not self.scroll_stop.is_set():
+            self.render_text(pages[index])
+            index = (index + 1) % len(pages)
+            self.scroll_stop.wait(OLED_PAGE_INTERVAL)
+    
+    def start_marquee(self, text):
+        """单行跑马灯: 放得下时用硬件滚动 (无后续总线流量)，否则软件滚动并只刷新所在两页"""
+        text = self.convert_to_ascii(text).replace('\n', ' ')
+        self.stop_scrolling()
+        
+        if self.text_renderer is None:
+            # 没有字形图集时无法局部绘制，整屏硬件滚动
+            self.render_text(text)
+            self.start_hw_scroll(0, self.oled.height // 8 - 1)
+            return "HW"
+        
+        renderer = self.text_renderer
+        text_width = sum(self.char_width(c) for c in text)
+        if text_width <= self.oled.width:
+            frame = bytearray(self.oled.width * self.oled.height // 8)
+            renderer.blit_line(frame, text, MARQUEE_PAGE * 8)
+            with self.display_lock:
+                self.oled.buffer[self.framebuffer_offset:] = frame
+                self.oled.show()
+                self.current_frame = None
+            self.start_hw_scroll(MARQUEE_PAGE, MARQUEE_PAGE + 1)
+            return "HW"
+        
+        # 整行文字的列数据 (16 位一列)，末尾加空白间隔后循环滚动
+        strip = array.array('H')
+        for char in text:
+            code = ord(char)
+            offset = renderer.offsets[code]
+            strip.extend(renderer.columns[offset:offset + renderer.widths[code]])
+        strip.extend([0] * MARQUEE_GAP)
+        
+        with self.display_lock:
+            self.oled.fill(0)
+            self.oled.show()
+            self.current_frame = None
+        self.scroll_stop.clear()
+        self.scroll_thread = threading.Thread(target=self._marquee_worker, args=(strip,), name="oled-marquee",
+                                              daemon=True)
+        self.scroll_thread.start()
+        return "SW"
+    
+    def _marquee_worker(self, strip):
+        """软件跑马灯线程: 每次移动一个像素，只重写跑马灯所在的两页"""
+        width = self.oled.width
+        band = bytearray(2 * width)
+        length = len(strip)
+        position = 0
+        while not self.scroll_stop.wait(MARQUEE_INTERVAL):
+            for x in range(width):
+                column = strip[(position + x) % length]
+                band[x] = column & 0xFF
+                band[width + x] = column >> 8
+            try:
+                self.write_region(0, MARQUEE_PAGE, width, band)
+            except Exception as e:
+                print(f"OLED 跑马灯刷新错误: {e}")
+                break
+            position = (position + 1) % length
+    
+    def write_region(self, x, first_page, width, data):
+        """只把一个矩形区域 (x 起 width 列，从 first_page 起若干页) 写入OLED
+        
+        data 按页排列，每页 width 字节；水平寻址模式下设定列/页窗口后数据会自动换行到下一页
+        """
+        pages = len(data) // width
+        with self.display_lock:
+            for page in range(pages):
+                start = self.framebuffer_offset + (first_page + page) * self.oled.width + x
+                self.oled.buffer[start:start + width] = data[page * width:(page + 1) * width]
+            self.current_frame = None
+            
+            device = getattr(self.oled, "i2c_device", None)
+            if device is None:
+                self.oled.show()
+                return
+            # 设置列地址和页地址范围，随后的数据只落在这个窗口内
+            for cmd in (0x21, x, x + width - 1, 0x22, first_page, first_page + pages - 1):
+                self.oled.write_cmd(cmd)
+            self.page_tx[1:1 + len(data)] = data
+            with device:
+                device.write(self.page_tx, end=1 + len(data))
+    
+    def read_region(self, x, first_page, width, pages):
+        """读出帧缓冲中一个矩形区域 (按页排列)"""
+        out = bytearray(width * pages)
+        for page in range(pages):
+            start = self.framebuffer_offset + (first_page + page) * self.oled.width + x
+            out[page * width:(page + 1) * width] = self.oled.buffer[start:start + width]
+        return out
+    
+    def decode_bitmap(self, encoding, payload, x, page, width, pages):
+        """解码位图数据: RAW 原始页数据，RLE 游程编码，DELTA 为与当前画面异或后的游程编码"""
+        data = base64.b64decode(payload, validate=True)
+        length = width * pages
+        if encoding == "RAW":
+            if len(data) != length:
+                raise ValueError(f"RAW data is {len(data)} bytes, expected {length}")
+            return bytearray(data)
+        if encoding == "RLE":
+            return rle_decode(data, length)
+        if encoding == "DELTA":
+            delta = rle_decode(data, length)
+            current = self.read_region(x, page, width, pages)
+            for i in range(length):
+                delta[i] ^= current[i]
+            return delta
+        raise ValueError(f"unknown encoding {encoding}")
+    
+    def check_region(self, x, page, width, pages):
+        """检查区域是否在屏幕内"""
+        if width <= 0 or pages <= 0 or x < 0 or page < 0 \
+                or x + width > self.oled.width or page + pages > self.oled.height // 8:
+            raise ValueError(f"region {x},{page} {width}x{pages} out of screen")
+    
+    def draw_bitmap(self, x, page, width, pages, data):
+        """把页格式位图直接写入帧缓冲并局部刷新"""
+        self.stop_scrolling()
+        self.write_region(x, page, width, data)
+        self.save_frame_state()
+    
+    def save_frame_state(self):
+        """把当前整帧记入状态存储，重启后原样恢复"""
+        start = self.framebuffer_offset
+        frame = bytes(self.oled.buffer[start:start + self.oled.width * self.oled.height // 8])
+        self.state_store.set("oled_frame", base64.b64encode(frame).decode('ascii'))
+        self.state_store.set("oled_mode", "image")
+    
+    def restore_frame(self, encoded):
+        """恢复保存的整帧画面"""
+        try:
+            frame = base64.b64decode(encoded)
+            with self.display_lock:
+                self.oled.buffer[self.framebuffer_offset:] = frame
+                self.oled.show()
+                self.current_frame = None
+        except Exception as e:
+            print(f"⚠️ 恢复OLED画面失败: {e}")
+            self.display_text("Waiting...")
+    
+    def save_icon(self, icon_id, width, pages, data):
+        """缓存图标并写入 ICON_DIR，重启后仍可按 id 调用"""
+        self.icons[icon_id] = (width, pages, bytes(data))
+        os.makedirs(ICON_DIR, exist_ok=True)
+        tmp_path = os.path.join(ICON_DIR, icon_id + ".icon.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(bytes((width, pages)) + bytes(data))
+        os.replace(tmp_path, os.path.join(ICON_DIR, icon_id + ".icon"))
+    
+    def load_icon(self, icon_id):
+        """按 id 取图标，内存中没有时从磁盘加载 (文件长度与尺寸不符时视为不存在)"""
+        icon = self.icons.get(icon_id)
+        if icon is None:
+            try:
+                with open(os.path.join(ICON_DIR, icon_id + ".icon"), "rb") as f:
+                    raw = f.read()
+            except FileNotFoundError:
+                return None
+            if len(raw) < 2 or len(raw) - 2 != raw[0] * raw[1]:
+                print(f"⚠️ 图标文件 {icon_id}.icon 已损坏 ({len(raw)} 字节)，忽略")
+                return None
+            icon = (raw[0], raw[1], raw[2:])
+            self.icons[icon_id] = icon
+        return icon
+    
+    def delete_icon(self, icon_id):
+        """删除图标"""
+        self.icons.pop(icon_id, None)
+        try:
+            os.remove(os.path.join(ICON_DIR, icon_id + ".icon"))
+            return True
+        except FileNotFoundError:
+            return False
+    
+    def start_hw_scroll(self, first_page, last_page):
+        """启动 SSD1306 硬件水平滚动，滚动期间不占用 I2C 总线"""
+        with self.display_lock:
+            for cmd in (0x2E, 0x27, 0x00, first_page, OLED_HW_SCROLL_SPEED, last_page, 0x00, 0xFF, 0x2F):
+                self.oled.write_cmd(cmd)
+            self.hw_scroll_active = True
+    
+    def stop_scrolling(self):
+        """停止翻页/跑马灯"""
+        self.scroll_stop.set()
+        if self.scroll_thread and self.scroll_thread is not threading.current_thread():
+            self.scroll_thread.join(timeout=2)
+        self.scroll_thread = None
+        if self.hw_scroll_active:
+            with self.display_lock:
+                try:
+                    # 停止硬件滚动后显存内容已错位，需要重写一次
+                    self.oled.write_cmd(0x2E)
+                    self.oled.show()
+                except Exception as e:
+                    print(f"OLED 停止滚动错误: {e}")
+                self.hw_scroll_active = False
+    
+    def display_text_pil(self, text):
+        """用 PIL 绘制文本 (字形图集不可用时的后备路径)"""
         try:
             # 清除显示
             self.oled.fill(0)
@@ -528,83 +1389,885 @@ class RaspberryPiController:
             # 分行显示文本
             lines = display_text.split('\n')
             y_offset = 0
-            line_height = 12
+            line_height = OLED_LINE_HEIGHT
             
             for line in lines:
                 if y_offset < self.oled.height - line_height:
-                    # 确保文本是ASCII编码
-                    safe_line = line.encode('ascii', 'ignore').decode('ascii')
-                    draw.text((0, y_offset), safe_line, font=font, fill=1)
+                    draw.text((0, y_offset), line, font=font, fill=1)
                     y_offset += line_height
             
             # 显示图像
-            self.oled.image(image)
-            self.oled.show()
+            with self.display_lock:
+                self.oled.image(image)
+                self.oled.show()
+                self.current_frame = None
             
         except Exception as e:
             print(f"OLED 显示错误: {e}")
     
     def convert_to_ascii(self, text):
         """将中文文本转换为ASCII可显示的文本"""
-        # 中文到英文的简单映射
-        chinese_to_english = {
-            "等待连接": "Waiting...",
-            "蓝牙等待连接": "BT Waiting",
-            "已连接": "Connected",
-            "蓝牙已连接": "BT Connected", 
-            "蓝牙已断开": "BT Disconnected",
-            "连接已断开": "Disconnected",
-            "舵机": "Servo",
-            "服务器已关闭": "Server Closed",
-            "温度": "Temp",
-            "时间": "Time",
-            "状态": "Status",
-            "正常": "Normal"
-        }
-        
-        # 替换中文文本
-        for chinese, english in chinese_to_english.items():
-            text = text.replace(chinese, english)
-        
-        # 移除其他非ASCII字符
-        return ''.join(char for char in text if ord(char) < 128)
+        if text.isascii():
+            return text
+        # 替换中文文本，再移除其他非ASCII字符
+        text = CHINESE_PATTERN.sub(lambda match: CHINESE_TO_ENGLISH[match.group(0)], text)
+        return text.translate(ASCII_TABLE)
     
     def clear_oled(self):
         """清除OLED显示"""
+        self.stop_scrolling()
         try:
-            self.oled.fill(0)
-            self.oled.show()
+            with self.display_lock:
+                self.oled.fill(0)
+                self.oled.show()
+                self.current_frame = None
         except Exception as e:
             print(f"OLED 清除错误: {e}")
     
-    def process_command(self, command):
-        """处理接收到的命令"""
+    def on_link_lost(self):
+        """链路丢失时执行失效保护动作"""
+        print(f"💔 链路丢失，执行失效保护动作: {LINK_LOSS_ACTION}")
+        if LINK_LOSS_ACTION == "center":
+            self.clear_schedule()
+            self.center_servos()
+        else:
+            self.stop_motion()
+        self.post_display("Link Lost\nFail-safe")
+    
+    def start_command_lanes(self):
+        """启动执行器线程和显示线程"""
+        if self.lanes_active:
+            return
+        self.lanes_active = True
+        if REALTIME_MODE:
+            # 启动期间产生的对象全部移入永久代，之后的回收只扫描新对象
+            gc.collect()
+            gc.freeze()
+            gc.disable()
+            print(f"⏱️ 实时模式: 已冻结 {gc.get_freeze_count()} 个对象，GC 由执行器调度")
+        self.actuator_thread = threading.Thread(target=self._actuator_worker, name="actuator", daemon=True)
+        self.actuator_thread.start()
+        self.display_thread = threading.Thread(target=self._display_worker, name="display", daemon=True)
+        self.display_thread.start()
+        print(f"⚙️ 命令通道已启动 (执行器节拍 {ACTUATOR_TICK * 1000:.0f}ms)")
+    
+    def stop_command_lanes(self):
+        """停止执行器线程和显示线程"""
+        if not self.lanes_active:
+            return
+        self.lanes_active = False
+        self.actuator_wake.set()
+        with self.display_cond:
+            self.display_cond.notify_all()
+        for thread in (self.actuator_thread, self.display_thread):
+            if thread and thread is not threading.current_thread():
+                thread.join(timeout=2)
+        self.actuator_thread = None
+        self.display_thread = None
+        if REALTIME_MODE:
+            gc.enable()
+    
+    def move_servo(self, index, angle):
+        """提交舵机目标角度: 通道运行时只记录最新目标，由执行器在下一个节拍输出"""
+        if not self.lanes_active:
+            return self.set_servo_angle(index, angle)
+        with self.motion_lock:
+            if self.motion_targets[index] is not None:
+                # 上一个目标还没输出就被新目标覆盖
+                self.stats["coalesced"] += 1
+            self.motion_targets[index] = angle
+        return True
+    
+    def stop_motion(self):
+        """丢弃所有尚未输出的舵机目标和定时命令，舵机停在当前位置"""
+        self.clear_schedule()
+        with self.motion_lock:
+            self.motion_targets[0] = None
+            self.motion_targets[1] = None
+    
+    def center_servos(self):
+        """丢弃排队的目标并立即回中"""
+        with self.motion_lock:
+            self.motion_targets[0] = None
+            self.motion_targets[1] = None
+            ok = self.set_servo_angle(0, 90)
+            return self.set_servo_angle(1, 90) and ok
+    
+    def apply_motion_targets(self):
+        """输出最新的舵机目标 (执行器线程每个节拍调用一次)"""
+        with self.motion_lock:
+            if self.shm_map is not None:
+                self.poll_shared_targets()
+            targets = self.motion_targets
+            for index in (0, 1):
+                angle = targets[index]
+                if angle is not None:
+                    targets[index] = None
+                    self.set_servo_angle(index, angle)
+    
+    def _actuator_worker(self):
+        """执行器线程: 固定节拍输出舵机目标"""
+        if REALTIME_MODE:
+            self.enter_realtime()
+        next_tick = time.monotonic()
+        while self.lanes_active:
+            now = time.monotonic()
+            late = now - next_tick
+            if late >= 0:
+                self.record_jitter(late)
+            if self.schedule:
+                self.run_due_commands(now)
+            self.apply_motion_targets()
+            next_tick += ACTUATOR_TICK
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                if REALTIME_MODE and delay > GC_SLACK:
+                    self.collect_garbage()
+                    delay = next_tick - time.monotonic()
+                if delay > 0:
+                    self.actuator_wake.wait(delay)
+                    self.actuator_wake.clear()
+            else:
+                # 落后于节拍时不补帧，从当前时间重新计时
+                next_tick = time.monotonic()
+    
+    def schedule_command(self, due, command):
+        """登记定时命令 (due 为 time.monotonic 时间)，队列已满时返回 False"""
+        with self.schedule_lock:
+            if len(self.schedule) >= SCHEDULE_MAX_PENDING:
+                return False
+            self.schedule_seq += 1
+            heapq.heappush(self.schedule, (due, self.schedule_seq, command))
+            self.stats["scheduled"] += 1
+        return True
+    
+    def clear_schedule(self):
+        """丢弃所有尚未执行的定时命令"""
+        with self.schedule_lock:
+            dropped = len(self.schedule)
+            self.schedule.clear()
+        if dropped:
+            print(f"⏲️ 已丢弃 {dropped} 条定时命令")
+    
+    def run_due_commands(self, now):
+        """执行所有已到期的定时命令 (执行器线程在输出舵机目标前调用)"""
+        while True:
+            with self.schedule_lock:
+                if not self.schedule or self.schedule[0][0] > now:
+                    return
+                due, _, command = heapq.heappop(self.schedule)
+            if now - due > ACTUATOR_TICK:
+                self.stats["late"] += 1
+            self.execute_scheduled(command)
+    
+    def sync_clock(self, client_ms):
+        """用一个 (客户端时间, 到达时间) 样本更新时钟偏移估计，返回当前偏移 (秒)"""
+        now = time.monotonic()
+        sample = now - client_ms / 1000.0
+        offset = self.clock_offset
+        if offset is not None:
+            # 没有更快的样本时偏移缓慢上浮，以跟随两端时钟漂移
+            offset += (now - self.clock_sync_time) * CLOCK_DRIFT
+            if abs(sample - offset) > CLOCK_MAX_STEP:
+                self.clock_outliers += 1
+                if self.clock_outliers < CLOCK_RESYNC_SAMPLES:
+                    return self.clock_offset
+                print(f"⏱️ 客户端时钟跳变 {(offset - sample) * 1000:.0f}ms，重新估计偏移")
+                offset = None
+        self.clock_outliers = 0
+        if offset is None or sample < offset:
+            offset = sample
+        self.clock_offset = offset
+        self.clock_sync_time = now
+        return offset
+    
+    def playout_time(self, client_ms):
+        """带时间戳命令的执行时间 (monotonic 秒)"""
+        return client_ms / 1000.0 + self.sync_clock(client_ms) + PLAYOUT_DELAY
+    
+    def execute_scheduled(self, command):
+        """执行一条定时命令；受理时已回复过客户端，这里只记录失败"""
+        if self.lanes_active and command.startswith(DISPLAY_COMMAND_PREFIXES):
+            self.submit_display_command(command, self.log_scheduled_response)
+            return
+        response = self.process_command(command)
+        if response:
+            self.log_scheduled_response(response.encode('utf-8'))
+    
+    def log_scheduled_response(self, data):
+        """定时命令的响应不发给客户端，失败时打印日志"""
+        if data.startswith(b"ERROR"):
+            print(f"⚠️ 定时命令执行失败: {data.decode('utf-8', 'replace')}")
+    
+    def enter_realtime(self):
+        """把当前线程 (执行器) 绑定到实时核并切换为 SCHED_FIFO"""
+        try:
+            os.sched_setaffinity(0, {REALTIME_CPU})
+        except Exception as e:
+            print(f"⚠️ 执行器绑定 CPU {REALTIME_CPU} 失败: {e}")
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(REALTIME_PRIORITY))
+            print(f"⏱️ 执行器已切换为 SCHED_FIFO 优先级 {REALTIME_PRIORITY}，CPU {REALTIME_CPU}")
+        except PermissionError:
+            print("⚠️ 没有权限设置 SCHED_FIFO (需要 root 或 CAP_SYS_NICE)，使用普通调度")
+        except Exception as e:
+            print(f"⚠️ 设置实时调度失败: {e}")
+    
+    def collect_garbage(self):
+        """在节拍空闲时段按需做分代回收 (自动 GC 已关闭)"""
+        if gc.get_count()[0] < gc.get_threshold()[0]:
+            return
+        self.gc_collections += 1
+        if self.gc_collections % GC_FULL_EVERY == 0:
+            gc.collect()
+        elif self.gc_collections % 10 == 0:
+            gc.collect(1)
+        else:
+            gc.collect(0)
+    
+    def record_jitter(self, late):
+        """记录一次节拍延迟"""
+        self.jitter_samples[self.jitter_index] = late
+        self.jitter_index = (self.jitter_index + 1) % JITTER_SAMPLES
+        self.jitter_count += 1
+    
+    def jitter_stats(self):
+        """返回节拍延迟统计 (微秒): 平均值、p99、最大值"""
+        count = min(self.jitter_count, JITTER_SAMPLES)
+        if not count:
+            return 0, 0, 0
+        samples = sorted(self.jitter_samples[:count])
+        mean = sum(samples) / count
+        p99 = samples[min(int(count * 0.99), count - 1)]
+        return int(mean * 1e6), int(p99 * 1e6), int(samples[-1] * 1e6)
+    
+    def show_status_text(self, text):
+        """显示状态文本；翻页/跑马灯进行中或正在显示位图时不打断，屏幕内容与保存的 oled_mode 保持一致
+
+        (DELTA 位图以当前画面为基准，状态文本覆盖位图后下一帧 DELTA 会解码出错)
+        """
+        if self.scroll_thread is not None or self.hw_scroll_active \
+                or self.state_store.get("oled_mode") == "image":
+            return
+        self.display_text(text)
+    
+    def post_display(self, text):
+        """提交状态文本到显示通道 (连续的状态文本只保留最新一条)"""
+        if not self.lanes_active:
+            self.show_status_text(text)
+            return
+        with self.display_cond:
+            if self.display_queue and self.display_queue[-1][0] == "text":
+                self.display_queue[-1] = ("text", text)
+            else:
+                self.display_queue.append(("text", text))
+            self.display_cond.notify()
+    
+    def submit_display_command(self, command, reply=None):
+        """把显示命令放入最低优先级通道，处理完成后由显示线程回复；窗口已满时拒绝
+        
+        reply 为本机客户端的回复函数，None 表示回复蓝牙客户端
+        """
+        with self.display_cond:
+            if self.display_credits() <= 0:
+                self.stats["shed"] += 1
+                shed = True
+            else:
+                self.display_queue.append(("command", (command, reply)))
+                self.display_pending += 1
+                self.display_cond.notify()
+                shed = False
+        if shed:
+            print(f"🚦 显示通道已满，丢弃命令 (累计 {self.stats['shed']} 条)")
+            (reply or self.send_response)(b"ERROR:BUSY")
+    
+    def display_credits(self):
+        """显示通道还能接受的命令数 (只读计数，不遍历队列，其他线程可同时入队出队)"""
+        return max(FLOW_WINDOW - self.display_pending, 0)
+    
+    def _display_worker(self):
+        """显示线程: 依次处理显示命令和状态文本"""
+        while self.lanes_active:
+            with self.display_cond:
+                while self.lanes_active and not self.display_queue:
+                    self.display_cond.wait(0.5)
+                if not self.lanes_active:
+                    break
+                kind, payload = self.display_queue.popleft()
+                if kind == "command":
+                    self.display_pending -= 1
+            
+            if kind == "text":
+                self.show_status_text(payload)
+                continue
+            command, reply = payload
+            response = self.process_command(command)
+            self.stats["display_done"] += 1
+            try:
+                if reply is not None:
+                    reply(response.encode('utf-8'))
+                    continue
+                if response:
+                    self.send_response(response.encode('utf-8'))
+                if self.flow_enabled:
+                    # 处理完一条显示命令就归还一个信用
+                    self.send_to_client(f"CREDIT:{self.display_credits()}\n".encode('utf-8'))
+            except Exception as e:
+                print(f"⚠️ 显示命令响应发送失败: {e}")
+    
+    def start_local_api(self):
+        """启动本机控制接口 (Unix 域套接字、可选 TCP 端口和共享内存目标块)"""
+        if LOCAL_SOCKET_PATH:
+            try:
+                if os.path.exists(LOCAL_SOCKET_PATH):
+                    # 上次异常退出留下的套接字文件
+                    os.remove(LOCAL_SOCKET_PATH)
+                server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                server.bind(LOCAL_SOCKET_PATH)
+                os.chmod(LOCAL_SOCKET_PATH, 0o660)
+                self.start_local_server(server, LOCAL_SOCKET_PATH)
+            except Exception as e:
+                print(f"⚠️ 本机控制套接字启动失败: {e}")
+        if LOCAL_TCP_PORT and not LOCAL_TOKEN and not self.is_loopback_host(LOCAL_TCP_HOST):
+            print(f"❌ 本机控制 TCP 端口绑定到 {LOCAL_TCP_HOST} 但未设置 RPI_LOCAL_TOKEN，已拒绝启动")
+        elif LOCAL_TCP_PORT:
+            try:
+                server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                server.bind((LOCAL_TCP_HOST, LOCAL_TCP_PORT))
+                self.start_local_server(server, f"tcp://{LOCAL_TCP_HOST}:{LOCAL_TCP_PORT}")
+            except Exception as e:
+                print(f"⚠️ 本机控制 TCP 端口启动失败: {e}")
+        if SHM_TARGET_PATH:
+            self.open_shared_targets()
+    
+    def is_loopback_host(self, host):
+        """绑定地址是否只允许本机访问"""
+        return host == "localhost" or host.startswith("127.") or host == "::1"
+    
+    def check_local_token(self, line):
+        """校验 TCP 客户端发送的 AUTH:<令牌>"""
+        prefix, _, token = line.strip().partition(b":")
+        return prefix == b"AUTH" and hmac.compare_digest(token, LOCAL_TOKEN.encode('utf-8'))
+    
+    def start_local_server(self, server, name):
+        """开始在已绑定的套接字上接受本机客户端"""
+        server.listen(4)
+        self.local_servers.append(server)
+        threading.Thread(target=self._local_accept_worker, args=(server,), name="local-accept",
+                         daemon=True).start()
+        print(f"🔌 本机控制接口已启动: {name}")
+    
+    def stop_local_api(self):
+        """关闭本机控制接口"""
+        for server in self.local_servers:
+            try:
+                server.close()
+            except Exception:
+                pass
+        self.local_servers = []
+        for conn in list(self.local_clients):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+        if LOCAL_SOCKET_PATH and os.path.exists(LOCAL_SOCKET_PATH):
+            try:
+                os.remove(LOCAL_SOCKET_PATH)
+            except OSError:
+                pass
+        if self.shm_map is not None:
+            with self.motion_lock:
+                self.shm_map.close()
+                self.shm_map = None
+            os.close(self.shm_file)
+            self.shm_file = None
+    
+    def _local_accept_worker(self, server):
+        """接受本机客户端，每个连接一个线程"""
+        while self.is_running:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                break
+            if conn.family != socket.AF_UNIX:
+                # 小命令帧不等待合并
+                conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.local_clients.add(conn)
+            threading.Thread(target=self._local_client_worker, args=(conn,), name="local-client",
+                             daemon=True).start()
+    
+    def _local_client_worker(self, conn):
+        """本机客户端线程: 按换行分帧处理命令，每条命令回复一行"""
+        send_lock = threading.Lock()
+        
+        def reply(data):
+            self.trace.record(TRACE_RESP, 1, 0.0, data, 0, len(data))
+            with send_lock:
+                conn.sendall(data + b"\n")
+        
+        pending = b""
+        discarding = False  # 超长帧已报错，丢弃到下一个换行为止
+        authenticated = not LOCAL_TOKEN or conn.family == socket.AF_UNIX
+        try:
+            while self.is_running:
+                data = conn.recv(RX_BUFFER_SIZE)
+                if not data:
+                    break
+                lines = (pending + data).split(b"\n")
+                pending = lines.pop()
+                if discarding and lines:
+                    lines.pop(0)
+                    discarding = False
+                if discarding:
+                    pending = b""
+                elif len(pending) > RX_BUFFER_SIZE:
+                    reply(RESP_FRAME_TOO_LONG)
+                    pending = b""
+                    discarding = True
+                for line in lines:
+                    if not authenticated:
+                        authenticated = self.check_local_token(line)
+                        if not authenticated:
+                            print("🔒 本机控制客户端令牌错误，已断开")
+                            reply(b"ERROR:AUTH_FAILED")
+                            return
+                        reply(b"OK:AUTH")
+                        continue
+                    self.handle_local_command(line, reply)
+        except OSError:
+            pass
+        finally:
+            self.local_clients.discard(conn)
+            conn.close()
+    
+    def handle_local_command(self, line, reply):
+        """处理本机客户端的一条命令，与蓝牙命令共用同一套舵机/显示通道"""
+        line = line.strip()
+        if not line:
+            return
+        self.trace.record(TRACE_RX, 1, 0.0, line, 0, len(line))
+        if line == b"PING" or line == b"HB":
+            return
+        self.command_count += 1
+        self.stats["received"] += 1
+        response = self.fast_servo_command(line, 0, len(line))
+        if response is not None:
+            reply(response)
+            return
+        try:
+            command = line.decode('utf-8')
+        except UnicodeDecodeError:
+            reply(RESP_DECODE_ERROR)
+            return
+        if command.startswith(LOCAL_UNSUPPORTED_COMMANDS):
+            reply(b"ERROR:LOCAL_UNSUPPORTED")
+            return
+        if self.lanes_active and command.startswith(DISPLAY_COMMAND_PREFIXES):
+            self.submit_display_command(command, reply)
+            return
+        response = self.process_command(command, local=True)
+        if response is not None:
+            reply(response.encode('utf-8'))
+    
+    def open_shared_targets(self):
+        """创建/映射共享内存目标块，已有内容视为旧数据不执行"""
+        try:
+            fd = os.open(SHM_TARGET_PATH, os.O_RDWR | os.O_CREAT, 0o660)
+            if os.fstat(fd).st_size < SHM_SIZE:
+                os.ftruncate(fd, SHM_SIZE)
+            self.shm_map = mmap.mmap(fd, SHM_SIZE)
+            self.shm_file = fd
+            self.shm_seq = SHM_SEQ.unpack_from(self.shm_map, 0)[0]
+            print(f"🧠 共享内存目标块已映射: {SHM_TARGET_PATH} ({SHM_SIZE} 字节)")
+        except Exception as e:
+            print(f"⚠️ 共享内存目标块映射失败: {e}")
+    
+    def poll_shared_targets(self):
+        """按 seqlock 协议读取共享内存目标，有新目标时覆盖待输出目标 (调用方持有 motion_lock)"""
+        shm = self.shm_map
+        seq = SHM_SEQ.unpack_from(shm, 0)[0]
+        if seq == self.shm_seq or seq & 1:
+            return
+        angles = SHM_ANGLES.unpack_from(shm, SHM_SEQ.size)
+        if SHM_SEQ.unpack_from(shm, 0)[0] != seq:
+            # 读取期间被改写，下个节拍再读
+            return
+        self.shm_seq = seq
+        for index in (0, 1):
+            angle = angles[index]
+            if 0.0 <= angle <= 180.0:  # NaN 比较结果为 False，直接跳过
+                if self.motion_targets[index] is not None:
+                    self.stats["coalesced"] += 1
+                self.motion_targets[index] = angle
+    
+    def send_to_client(self, data):
+        """向客户端发送数据 (响应与遥测推送共用同一 socket，需加锁)"""
+        with self.send_lock:
+            if self.client_stream:
+                self.client_stream.sendall(data)
+    
+    def send_response(self, data):
+        """发送命令响应，开启流控或订阅遥测后以换行结尾便于客户端与 CREDIT/TLM 帧区分"""
+        self.trace.record(TRACE_RESP, 0, 0.0, data, 0, len(data))
+        if self.line_responses:
+            data = data + b"\n"
+        self.send_to_client(data)
+    
+    def start_telemetry(self, hz):
+        """开始或调整遥测推送频率，hz<=0 时停止"""
+        hz = min(hz, TELEMETRY_MAX_HZ)
+        if hz <= 0:
+            self.stop_telemetry()
+            return 0
+        
+        self.telemetry_hz = hz
+        if self.telemetry_thread and self.telemetry_thread.is_alive():
+            print(f"📊 遥测频率调整为 {hz}Hz")
+            return hz
+        
+        print(f"📊 启动遥测推送: {hz}Hz")
+        self.telemetry_stop.clear()
+        self.telemetry_thread = threading.Thread(target=self._telemetry_worker, name="telemetry", daemon=True)
+        self.telemetry_thread.start()
+        return hz
+    
+    def stop_telemetry(self):
+        """停止遥测推送"""
+        self.telemetry_hz = 0
+        self.telemetry_stop.set()
+        if self.telemetry_thread and self.telemetry_thread is not threading.current_thread():
+            self.telemetry_thread.join(timeout=2)
+        if self.telemetry_thread:
+            print("📊 遥测推送已停止")
+        self.telemetry_thread = None
+    
+    def _telemetry_worker(self):
+        """遥测推送线程"""
+        last_count = self.command_count
+        last_time = time.monotonic()
+        last_rssi_time = 0
+        rssi = None
+        
+        while not self.telemetry_stop.is_set() and self.telemetry_hz > 0:
+            now = time.monotonic()
+            count = self.command_count
+            rate = (count - last_count) / max(now - last_time, 1e-6)
+            last_count, last_time = count, now
+            
+            if now - last_rssi_time >= TELEMETRY_RSSI_INTERVAL:
+                rssi = self.read_link_rssi()
+                last_rssi_time = now
+            
+            frame = self.format_telemetry(rate, rssi)
+            try:
+                self.send_to_client(frame.encode('utf-8'))
+            except Exception as e:
+                print(f"📊 遥测发送失败，停止推送: {e}")
+                break
+            
+            self.telemetry_stop.wait(1.0 / self.telemetry_hz)
+    
+    def format_telemetry(self, rate, rssi):
+        """生成一帧紧凑的遥测文本，以换行结尾便于客户端分帧"""
+        temp = self.read_cpu_temperature()
+        temp_str = f"{temp:.1f}" if temp is not None else "NA"
+        rssi_str = str(rssi) if rssi is not None else "NA"
+        return (f"TLM:s1={self.servo_angles[0]},s2={self.servo_angles[1]},"
+                f"temp={temp_str},rate={rate:.1f},q={self.get_lane_depth()},"
+                f"rxq={self.get_queue_depth()},shed={self.stats['shed']},"
+                f"jit={self.jitter_stats()[1]},rssi={rssi_str}\n")
+    
+    def read_cpu_temperature(self):
+        """读取CPU温度 (摄氏度)"""
+        try:
+            with open(CPU_TEMP_PATH) as f:
+                return int(f.read().strip()) / 1000.0
+        except Exception:
+            return None
+    
+    def read_link_rssi(self):
+        """读取当前连接的蓝牙RSSI"""
+        if not self.client_address:
+            return None
+        try:
+            result = subprocess.run(['hcitool', 'rssi', self.client_address],
+                                    capture_output=True, text=True, timeout=2)
+            # 输出形如 "RSSI return value: -5"
+            return int(result.stdout.strip().rsplit(":", 1)[1])
+        except Exception:
+            return None
+    
+    def get_lane_depth(self):
+        """各命令通道中等待执行的命令数"""
+        motion = sum(1 for target in self.motion_targets if target is not None)
+        return motion + len(self.display_queue) + len(self.schedule)
+    
+    def get_queue_depth(self):
+        """客户端 socket 中尚未读取的字节数"""
+        try:
+            buf = array.array('i', [0])
+            fcntl.ioctl(self.client_socket.fileno(), termios.FIONREAD, buf)
+            return buf[0]
+        except Exception:
+            return 0
+    
+    def wrap_client_socket(self, client):
+        """把 PyBluez socket 包装成标准库 socket (支持 recv_into)，失败时退回原对象"""
+        try:
+            return socket.socket(fileno=os.dup(client.fileno()))
+        except Exception as e:
+            print(f"⚠️ 无法包装客户端 socket，使用 PyBluez 接口: {e}")
+            return client
+    
+    def recv_into_buffer(self, view):
+        """接收数据到预分配缓冲区，返回字节数"""
+        recv_into = getattr(self.client_stream, "recv_into", None)
+        if recv_into is not None:
+            return recv_into(view)
+        data = self.client_stream.recv(len(view))
+        view[:len(data)] = data
+        return len(data)
+    
+    def close_client(self):
+        """关闭客户端连接"""
+        for sock in (self.client_stream, self.client_socket):
+            if sock:
+                try:
+                    sock.close()
+                except:
+                    pass
+        self.client_stream = None
+        self.client_socket = None
+        self.client_address = None
+        self.flow_enabled = False
+        self.line_responses = False
+        self.clock_offset = None
+    
+    def split_legacy_heartbeats(self, end):
+        """未分帧模式下按换行结尾的心跳拆分一次接收，返回命令片段 [(start, end)]
+
+        旧版客户端的命令不带换行，但心跳协程发送 PING\n，两者可能粘在同一次接收里 (如 SERVO1:45PING\n)；
+        其他换行属于命令本身 (如多行 OLED 文本)，不拆分。片段数大于 1 说明拆出了心跳。
+        接收以心跳以外的换行结尾时返回 None，表示客户端已使用换行分帧
+        """
+        buf = self.rx_buffer
+        segments = []
+        start = 0
+        line = 0
+        newline = buf.find(b"\n", 0, end)
+        while newline >= 0:
+            stop = newline
+            while stop > line and buf[stop - 1] in FRAME_WHITESPACE:
+                stop -= 1
+            if buf.endswith(b"PING", line, stop):
+                segments.append((start, stop - 4))
+                start = newline + 1
+            elif buf.endswith(b"HB", line, stop):
+                segments.append((start, stop - 2))
+                start = newline + 1
+            elif newline == end - 1:
+                return None
+            line = newline + 1
+            newline = buf.find(b"\n", line, end)
+        segments.append((start, end))
+        return segments
+    
+    def dispatch_frame(self, start, end):
+        """处理接收缓冲区 [start, end) 中的一帧，返回该帧是否为心跳"""
+        buf = self.rx_buffer
+        while start < end and buf[start] in FRAME_WHITESPACE:
+            start += 1
+        while end > start and buf[end - 1] in FRAME_WHITESPACE:
+            end -= 1
+        if start == end:
+            return False
+        self.trace.record(TRACE_RX, 0, 0.0, self.rx_view, start, end)
+        
+        self.command_count += 1
+        self.stats["received"] += 1
+        length = end - start
+        if (length == 4 and buf.startswith(b"PING", start, end)) or \
+                (length == 2 and buf.startswith(b"HB", start, end)):
+            return True
+        
+        response = self.fast_servo_command(buf, start, end)
+        if response is None:
+            # 非热点命令走通用路径
+            try:
+                command = buf[start:end].decode('utf-8')
+            except UnicodeDecodeError as e:
+                print(f"❌ 数据解码失败: {e}")
+                self.send_response(RESP_DECODE_ERROR)
+                return False
+            if self.lanes_active and command.startswith(DISPLAY_COMMAND_PREFIXES):
+                self.submit_display_command(command)
+                return False
+            text_response = self.process_command(command)
+            if text_response is None:
+                return False
+            if VERBOSE:
+                print(f"📤 发送响应: '{text_response}'")
+            response = text_response.encode('utf-8')
+        
+        self.send_response(response)
+        return False
+    
+    def fast_servo_command(self, buf, start, end):
+        """零分配快速路径: 直接在缓冲区上解析 SERVO1:<角度>/SERVO2:<角度>
+        
+        返回预编码响应；不符合严格格式 (0-180 的整数或一位小数) 时返回 None 交给 process_command
+        """
+        if end - start < 8 or end - start > 12 or not buf.startswith(b"SERVO", start, end):
+            return None
+        index = buf[start + 5] - 49  # b'1' -> 0, b'2' -> 1
+        if (index != 0 and index != 1) or buf[start + 6] != 58:  # 58 == b':'
+            return None
+        
+        angle = 0
+        i = start + 7
+        while i < end and buf[i] != 46:  # 46 == b'.'
+            digit = buf[i] - 48
+            if digit < 0 or digit > 9:
+                return None
+            angle = angle * 10 + digit
+            i += 1
+        if i == start + 7 or i > start + 10 or angle > 180:
+            return None
+        
+        if i < end:
+            # 一位小数: 与 process_command 相同，按 float 处理，响应和显示文本现场格式化
+            tenth = buf[i + 1] - 48 if i + 2 == end else -1
+            if tenth < 0 or tenth > 9:
+                return None
+            angle = (angle * 10 + tenth) / 10.0
+            if angle > 180:
+                return None
+            if not self.move_servo(index, angle):
+                return RESP_SERVO_FAILED[index]
+            self.post_display(f"舵机{index + 1}: {angle}°")
+            return f"OK:SERVO{index + 1}:{angle}".encode('utf-8')
+        
+        if not self.move_servo(index, angle):
+            return RESP_SERVO_FAILED[index]
+        self.post_display(SERVO_DISPLAY_TEXT[index][angle])
+        return RESP_SERVO_OK[index][angle]
+    
+    def dump_trace(self):
+        """把命令跟踪写入 TRACE_DIR，返回文件路径"""
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        path = os.path.join(TRACE_DIR, time.strftime("trace-%Y%m%d-%H%M%S.bin"))
+        count = self.trace.dump(path)
+        print(f"🧾 命令跟踪已保存: {path} ({count} 条记录)")
+        return path
+    
+    def start_profile(self, seconds):
+        """启动一次限时栈采样，返回结果文件路径；已有采样在进行时返回 None"""
+        if self.profile_thread and self.profile_thread.is_alive():
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, time.strftime("profile-%Y%m%d-%H%M%S.folded"))
+        self.profile_stop.clear()
+        self.profile_thread = threading.Thread(target=self._profile_worker, args=(seconds, path),
+                                               name="profiler", daemon=True)
+        self.profile_thread.start()
+        print(f"🔬 开始栈采样 {seconds:g}秒 (间隔 {PROFILE_INTERVAL * 1000:g}ms)，结果写入 {path}")
+        return path
+    
+    def _profile_worker(self, seconds, path):
+        """采样线程: 定时抓取所有线程的调用栈并按折叠栈计数"""
+        own_ident = threading.get_ident()
+        labels = {}  # 代码对象 -> 栈帧标签，避免每次采样重复格式化
+        counts = Counter()
+        samples = 0
+        thread_names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self.profile_stop.is_set():
+            if samples % 200 == 0:
+                thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    label = labels.get(code)
+                    if label is None:
+                        label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                        labels[code] = label
+                    stack.append(label)
+                    frame = frame.f_back
+                stack.append(thread_names.get(ident, f"thread-{ident}"))
+                stack.reverse()
+                counts[";".join(stack)] += 1
+            samples += 1
+            self.profile_stop.wait(PROFILE_INTERVAL)
+        
+        try:
+            with open(path, "w") as f:
+                for stack, count in sorted(counts.items()):
+                    f.write(f"{stack} {count}\n")
+            print(f"🔬 栈采样完成: {samples} 次采样，{len(counts)} 个不同调用栈，已保存 {path}")
+        except OSError as e:
+            print(f"⚠️ 采样结果保存失败: {e}")
+    
+    def is_timeout_error(self, error):
+        """判断异常是否为接收超时 (PyBluez 会把超时包装成 BluetoothError)"""
+        return isinstance(error, socket.timeout) or "timed out" in str(error)
+    
+    def process_command(self, command, local=False):
+        """处理接收到的命令 (local 表示来自本机控制接口，不能操作蓝牙会话)"""
         try:
             command = command.strip()
-            print(f"收到命令: '{command}' (长度: {len(command)} 字节)")
-            print(f"命令原始字节: {command.encode('utf-8')}")
+            if VERBOSE:
+                print(f"收到命令: '{command}' (长度: {len(command)} 字节)")
+                print(f"命令原始字节: {command.encode('utf-8')}")
             
-            if command == "CONNECT":
-                print("处理连接命令")
-                self.display_text("蓝牙已连接")
+            if command in HEARTBEAT_COMMANDS:
+                # 心跳帧只用于保活，不回复，避免打乱客户端的请求/响应配对
+                return None
+                
+            elif command == "STOP":
+                if VERBOSE:
+                    print("处理急停命令")
+                self.stop_motion()
+                return "OK:STOPPED"
+                
+            elif command == "CENTER":
+                if VERBOSE:
+                    print("处理回中命令")
+                if self.center_servos():
+                    self.post_display("Servo Center")
+                    return "OK:CENTERED"
+                return "ERROR:CENTER_FAILED"
+                
+            elif command == "CONNECT":
+                if VERBOSE:
+                    print("处理连接命令")
+                self.post_display("蓝牙已连接")
                 return "OK:CONNECTED"
                 
             elif command == "DISCONNECT":
-                print("处理断开命令")
-                self.display_text("蓝牙已断开")
+                if VERBOSE:
+                    print("处理断开命令")
+                self.stop_motion()
+                self.post_display("蓝牙已断开")
                 return "OK:DISCONNECTED"
                 
             elif command.startswith("SERVO1:"):
-                print("处理舵机1命令")
+                if VERBOSE:
+                    print("处理舵机1命令")
                 try:
                     angle_str = command.split(":")[1]
-                    angle = int(angle_str)
-                    print(f"解析角度: {angle}")
+                    angle = self.parse_angle(angle_str)
+                    if VERBOSE:
+                        print(f"解析角度: {angle}")
                     if 0 <= angle <= 180:
-                        if self.control_servo1(angle):
-                            self.display_text(f"舵机1: {angle}°")
+                        if self.move_servo(0, angle):
+                            self.post_display(f"舵机1: {angle}°")
                             response = f"OK:SERVO1:{angle}"
-                            print(f"舵机1控制成功，响应: {response}")
+                            if VERBOSE:
+                                print(f"舵机1控制成功，响应: {response}")
                             return response
                         else:
                             print("舵机1控制失败")
@@ -617,16 +2280,19 @@ class RaspberryPiController:
                     return "ERROR:SERVO1_PARSE_ERROR"
                     
             elif command.startswith("SERVO2:"):
-                print("处理舵机2命令")
+                if VERBOSE:
+                    print("处理舵机2命令")
                 try:
                     angle_str = command.split(":")[1]
-                    angle = int(angle_str)
-                    print(f"解析角度: {angle}")
+                    angle = self.parse_angle(angle_str)
+                    if VERBOSE:
+                        print(f"解析角度: {angle}")
                     if 0 <= angle <= 180:
-                        if self.control_servo2(angle):
-                            self.display_text(f"舵机2: {angle}°")
+                        if self.move_servo(1, angle):
+                            self.post_display(f"舵机2: {angle}°")
                             response = f"OK:SERVO2:{angle}"
-                            print(f"舵机2控制成功，响应: {response}")
+                            if VERBOSE:
+                                print(f"舵机2控制成功，响应: {response}")
                             return response
                         else:
                             print("舵机2控制失败")
@@ -639,19 +2305,235 @@ class RaspberryPiController:
                     return "ERROR:SERVO2_PARSE_ERROR"
                     
             elif command.startswith("OLED:"):
-                print("处理OLED显示命令")
-                text = command[5:]  # 移除 "OLED:" 前缀
-                print(f"OLED文本: '{text}'")
-                self.display_text(text)
+                if VERBOSE:
+                    print("处理OLED显示命令")
+                text = command[5:].replace("\\n", "\n")  # 移除 "OLED:" 前缀，还原转义的换行
+                if VERBOSE:
+                    print(f"OLED文本: '{text}'")
+                pages = self.show_long_text(text)
+                if pages > 1:
+                    print(f"OLED文本超过一屏，分 {pages} 页轮播")
+                self.state_store.set("oled", text)
+                self.state_store.set("oled_mode", "text")
                 response = f"OK:OLED_DISPLAY"
-                print(f"OLED显示成功，响应: {response}")
+                if VERBOSE:
+                    print(f"OLED显示成功，响应: {response}")
                 return response
                 
+            elif command.startswith("AT:"):
+                # AT:<unix_ms>:<命令> 在指定系统时间执行 (已过期的在下一个节拍立即执行)
+                try:
+                    _, at_ms, inner = command.split(":", 2)
+                    delay = int(at_ms) / 1000.0 - time.time()
+                except ValueError:
+                    return "ERROR:AT_PARSE_ERROR"
+                if not inner or inner.startswith("AT:"):
+                    return "ERROR:AT_PARSE_ERROR"
+                if local and inner.startswith(LOCAL_UNSUPPORTED_COMMANDS):
+                    return "ERROR:LOCAL_UNSUPPORTED"
+                if delay > SCHEDULE_MAX_AHEAD:
+                    return "ERROR:AT_TOO_FAR"
+                if not self.lanes_active:
+                    self.execute_scheduled(inner)
+                elif not self.schedule_command(time.monotonic() + delay, inner):
+                    return "ERROR:BUSY"
+                return f"OK:AT:{at_ms}"
+                
+            elif command.startswith("T:"):
+                # T:<客户端毫秒>:<命令> 经播放缓冲后按客户端时间间隔执行
+                try:
+                    _, client_ms, inner = command.split(":", 2)
+                    client_ms = int(client_ms)
+                except ValueError:
+                    return "ERROR:T_PARSE_ERROR"
+                if not inner or inner.startswith(("T:", "AT:")):
+                    return "ERROR:T_PARSE_ERROR"
+                if local and inner.startswith(LOCAL_UNSUPPORTED_COMMANDS):
+                    return "ERROR:LOCAL_UNSUPPORTED"
+                due = self.playout_time(client_ms)
+                if due - time.monotonic() > SCHEDULE_MAX_AHEAD:
+                    return "ERROR:T_TOO_FAR"
+                if not self.lanes_active:
+                    self.execute_scheduled(inner)
+                elif not self.schedule_command(due, inner):
+                    return "ERROR:BUSY"
+                return f"OK:T:{client_ms}"
+                
+            elif command.startswith("SYNC:"):
+                # SYNC:<客户端毫秒> 补充一个时钟样本，返回当前偏移估计 (毫秒)
+                try:
+                    offset = self.sync_clock(int(command[5:]))
+                except ValueError:
+                    return "ERROR:SYNC_PARSE_ERROR"
+                return f"OK:SYNC:{offset * 1000:.1f}"
+                
+            elif command.startswith("CALIBRATE:"):
+                # CALIBRATE:<舵机>:<最小脉宽>:<中位脉宽>:<最大脉宽> (保留已有的非线性校正点) 或 CALIBRATE:<舵机>:RESET
+                if VERBOSE:
+                    print("处理舵机校准命令")
+                try:
+                    parts = command.split(":")
+                    index = int(parts[1]) - 1
+                    if index not in (0, 1):
+                        return "ERROR:INVALID_SERVO"
+                    if parts[2] == "RESET":
+                        calibration = ServoCalibration()
+                    else:
+                        calibration = ServoCalibration(int(parts[2]), int(parts[3]), int(parts[4]),
+                                                       self.calibrations[index].curve)
+                except (ValueError, IndexError) as e:
+                    print(f"校准命令解析错误: {e}")
+                    return "ERROR:CALIBRATE_PARSE_ERROR"
+                self.calibrate_servo(index, calibration)
+                return f"OK:CALIBRATE:{index + 1}"
+                
+            elif command.startswith("FLOW:"):
+                # FLOW:ON 开启信用流控，FLOW:OFF 关闭，FLOW:? 查询剩余信用
+                arg = command[5:]
+                if arg == "ON":
+                    self.flow_enabled = True
+                    self.line_responses = True
+                    print(f"🚦 客户端开启流控，显示通道窗口 {FLOW_WINDOW}")
+                elif arg == "OFF":
+                    self.flow_enabled = False
+                elif arg != "?":
+                    return "ERROR:FLOW_PARSE_ERROR"
+                return f"OK:FLOW:{self.display_credits()}"
+                
+            elif command == "STATS":
+                stats = ",".join(f"{key}={value}" for key, value in self.stats.items())
+                mean, p99, worst = self.jitter_stats()
+                return (f"OK:STATS:{stats},jitter_mean_us={mean},jitter_p99_us={p99},"
+                        f"jitter_max_us={worst},gc={self.gc_collections},rt={int(REALTIME_MODE)},"
+                        f"playout_ms={PLAYOUT_DELAY * 1000:g}")
+                
+            elif command.startswith("TELEMETRY:"):
+                if VERBOSE:
+                    print("处理遥测订阅命令")
+                arg = command[10:]
+                try:
+                    if arg == "ON":
+                        hz = TELEMETRY_DEFAULT_HZ
+                    elif arg == "OFF":
+                        hz = 0
+                    else:
+                        hz = float(arg)
+                except ValueError:
+                    return "ERROR:TELEMETRY_PARSE_ERROR"
+                hz = self.start_telemetry(hz)
+                if hz > 0:
+                    # 之后的响应与 TLM 帧交错，改为以换行结尾
+                    self.line_responses = True
+                return f"OK:TELEMETRY:{hz:g}"
+                
+            elif command.startswith("OLED_MARQUEE:"):
+                if VERBOSE:
+                    print("处理OLED跑马灯命令")
+                text = command[13:].replace("\\n", "\n")  # 还原转义的换行 (跑马灯显示为空格)
+                mode = self.start_marquee(text)
+                print(f"OLED跑马灯已启动 ({'硬件' if mode == 'HW' else '软件'}滚动)")
+                self.state_store.set("oled", text)
+                self.state_store.set("oled_mode", "marquee")
+                return f"OK:OLED_MARQUEE:{mode}"
+                
+            elif command == "OLED_SCROLL_STOP":
+                if VERBOSE:
+                    print("处理OLED停止滚动命令")
+                self.stop_scrolling()
+                self.state_store.set("oled_mode", "text")
+                return "OK:OLED_SCROLL_STOPPED"
+                
+            elif command.startswith("IMG:"):
+                # IMG:<x>:<起始页>:<宽度>:<页数>:<RAW|RLE|DELTA>:<base64数据>
+                if VERBOSE:
+                    print("处理OLED位图命令")
+                try:
+                    _, x, page, width, pages, encoding, payload = command.split(":", 6)
+                    x, page, width, pages = int(x), int(page), int(width), int(pages)
+                    self.check_region(x, page, width, pages)
+                    data = self.decode_bitmap(encoding, payload, x, page, width, pages)
+                except (ValueError, TypeError) as e:
+                    print(f"位图命令解析错误: {e}")
+                    return "ERROR:IMG_PARSE_ERROR"
+                self.draw_bitmap(x, page, width, pages, data)
+                return "OK:IMG"
+                
+            elif command.startswith("ICON_SAVE:"):
+                # ICON_SAVE:<id>:<宽度>:<页数>:<RAW|RLE>:<base64数据>
+                if VERBOSE:
+                    print("处理图标保存命令")
+                try:
+                    _, icon_id, width, pages, encoding, payload = command.split(":", 5)
+                    width, pages = int(width), int(pages)
+                    if not ICON_ID_PATTERN.match(icon_id) or encoding == "DELTA":
+                        raise ValueError(f"invalid icon id or encoding: {icon_id} {encoding}")
+                    self.check_region(0, 0, width, pages)
+                    data = self.decode_bitmap(encoding, payload, 0, 0, width, pages)
+                except (ValueError, TypeError) as e:
+                    print(f"图标命令解析错误: {e}")
+                    return "ERROR:ICON_PARSE_ERROR"
+                self.save_icon(icon_id, width, pages, data)
+                return f"OK:ICON_SAVED:{icon_id}"
+                
+            elif command.startswith("ICON_DELETE:"):
+                if VERBOSE:
+                    print("处理图标删除命令")
+                icon_id = command[12:]
+                if not ICON_ID_PATTERN.match(icon_id) or not self.delete_icon(icon_id):
+                    return "ERROR:ICON_NOT_FOUND"
+                return f"OK:ICON_DELETED:{icon_id}"
+                
+            elif command.startswith("ICON:"):
+                # ICON:<id>:<x>:<起始页>
+                if VERBOSE:
+                    print("处理图标显示命令")
+                try:
+                    _, icon_id, x, page = command.split(":")
+                    x, page = int(x), int(page)
+                except ValueError as e:
+                    print(f"图标命令解析错误: {e}")
+                    return "ERROR:ICON_PARSE_ERROR"
+                icon = self.load_icon(icon_id) if ICON_ID_PATTERN.match(icon_id) else None
+                if icon is None:
+                    return "ERROR:ICON_NOT_FOUND"
+                width, pages, data = icon
+                try:
+                    self.check_region(x, page, width, pages)
+                except ValueError as e:
+                    print(f"图标位置错误: {e}")
+                    return "ERROR:ICON_OUT_OF_SCREEN"
+                self.draw_bitmap(x, page, width, pages, data)
+                return f"OK:ICON:{icon_id}"
+                
+            elif command.startswith("PROFILE:"):
+                # PROFILE:<秒> 在后台做限时栈采样，不影响命令处理
+                if VERBOSE:
+                    print("处理栈采样命令")
+                try:
+                    seconds = float(command[8:])
+                except ValueError:
+                    return "ERROR:PROFILE_PARSE_ERROR"
+                if not 0 < seconds <= PROFILE_MAX_SECONDS:
+                    return "ERROR:PROFILE_INVALID_DURATION"
+                path = self.start_profile(seconds)
+                if path is None:
+                    return "ERROR:PROFILE_RUNNING"
+                return f"OK:PROFILE:{os.path.basename(path)}"
+                
+            elif command == "TRACE_DUMP":
+                if VERBOSE:
+                    print("处理跟踪导出命令")
+                return f"OK:TRACE_DUMP:{os.path.basename(self.dump_trace())}"
+                
             elif command == "OLED_CLEAR":
-                print("处理OLED清除命令")
+                if VERBOSE:
+                    print("处理OLED清除命令")
                 self.clear_oled()
+                self.state_store.set("oled", "")
+                self.state_store.set("oled_mode", "text")
                 response = "OK:OLED_CLEARED"
-                print(f"OLED清除成功，响应: {response}")
+                if VERBOSE:
+                    print(f"OLED清除成功，响应: {response}")
                 return response
                 
             else:
@@ -679,6 +2561,8 @@ class RaspberryPiController:
             return
         
         print("✅ 蓝牙服务器设置成功")
+        self.start_command_lanes()
+        self.start_local_api()
         print("")
         print("📱 连接步骤:")
         print("1. 在安卓设备上打开蓝牙设置")
@@ -699,64 +2583,137 @@ class RaspberryPiController:
                     print("🎮 可以开始使用遥控器功能")
                     
                     # 显示连接成功
-                    self.display_text("Connected!\nReady")
+                    self.trace.record(TRACE_LINK, 1)
+                    self.post_display("Connected!\nReady")
                     
                     # 连接建立后的主循环
+                    heartbeat_enabled = False
+                    missed_heartbeats = 0
+                    link_lost = False
+                    # 客户端的一次接收以换行 (心跳以外) 结尾后进入分帧模式；旧版客户端一次 recv 即一条命令
+                    framed = False
+                    pending = 0  # 缓冲区头部尚未凑成完整帧的字节数
+                    discarding = False  # 超长帧已报错，丢弃到下一个换行为止
+                    buf = self.rx_buffer
+                    view = self.rx_view
+                    
                     while self.is_running:
                         try:
-                            # 设置接收超时，避免长时间阻塞
-                            self.client_socket.settimeout(30.0)
+                            # 客户端启用心跳后使用短超时快速发现死链，否则沿用旧的空闲超时
+                            if heartbeat_enabled:
+                                self.client_stream.settimeout(HEARTBEAT_INTERVAL)
+                            else:
+                                self.client_stream.settimeout(LEGACY_IDLE_TIMEOUT)
                             
-                            print("📡 等待接收命令...")
+                            if VERBOSE:
+                                print("📡 等待接收命令...")
                             
-                            # 接收数据
-                            data = self.client_socket.recv(1024)
+                            # 接收数据到预分配缓冲区
+                            try:
+                                if pending:
+                                    nbytes = self.recv_into_buffer(view[pending:])
+                                else:
+                                    nbytes = self.recv_into_buffer(view)
+                            except (socket.timeout, bluetooth.BluetoothError) as e:
+                                if not self.is_timeout_error(e):
+                                    raise
+                                if not heartbeat_enabled:
+                                    # 旧版客户端空闲不代表链路丢失，与以前一样只断开连接，不执行失效保护
+                                    print(f"⏰ {LEGACY_IDLE_TIMEOUT}秒内未收到数据，断开空闲连接")
+                                    break
+                                missed_heartbeats += 1
+                                print(f"💓 心跳丢失 {missed_heartbeats}/{HEARTBEAT_MISS_LIMIT}")
+                                if missed_heartbeats >= HEARTBEAT_MISS_LIMIT:
+                                    link_lost = True
+                                    break
+                                continue
                             
-                            if not data:
+                            if not nbytes:
                                 print("📱 客户端主动断开连接 (接收到空数据)")
                                 break
                             
-                            print(f"📥 接收到原始数据: {data}")
-                            print(f"📏 数据长度: {len(data)} 字节")
+                            # 任何数据都说明链路存活
+                            missed_heartbeats = 0
+                            end = pending + nbytes
                             
-                            try:
-                                decoded_data = data.decode('utf-8')
-                                print(f"📝 解码后命令: '{decoded_data}'")
-                            except UnicodeDecodeError as e:
-                                print(f"❌ 数据解码失败: {e}")
-                                print(f"原始字节: {data.hex()}")
-                                response = "ERROR:DECODE_ERROR"
-                                self.client_socket.send(response.encode('utf-8'))
-                                continue
-                                
-                            # 处理命令
-                            print("🔄 开始处理命令...")
-                            response = self.process_command(decoded_data)
-                            print(f"📤 准备发送响应: '{response}'")
+                            if VERBOSE:
+                                print(f"📥 接收到原始数据: {bytes(view[pending:end])}")
+                            
+                            if discarding:
+                                newline = buf.find(b"\n", 0, end)
+                                if newline < 0:
+                                    # 旧版客户端没有换行，一次未填满缓冲区的接收即为超长帧的结尾
+                                    if not framed and end < len(buf):
+                                        discarding = False
+                                    continue
+                                discarding = False
+                                framed = True
+                                end -= newline + 1
+                                if not end:
+                                    continue
+                                buf[:end] = view[newline + 1:newline + 1 + end]
+                            
+                            heartbeat = False
+                            legacy_segments = None
+                            if not framed and buf.find(b"\n", pending, end) >= 0:
+                                legacy_segments = self.split_legacy_heartbeats(end)
+                                framed = legacy_segments is None
+                            
+                            if framed:
+                                start = 0
+                                newline = buf.find(b"\n", 0, end)
+                                while newline >= 0:
+                                    if self.dispatch_frame(start, newline):
+                                        heartbeat = True
+                                    start = newline + 1
+                                    newline = buf.find(b"\n", start, end)
+                                pending = end - start
+                                if pending and start:
+                                    # 把不完整的帧移到缓冲区头部
+                                    buf[:pending] = view[start:end]
+                                elif pending == len(buf):
+                                    print("❌ 帧超过接收缓冲区大小，已丢弃")
+                                    self.send_response(RESP_FRAME_TOO_LONG)
+                                    pending = 0
+                                    discarding = True
+                            elif end == len(buf):
+                                # 未分帧时填满缓冲区说明命令被截断，不能按两条命令执行
+                                print("❌ 帧超过接收缓冲区大小，已丢弃")
+                                self.send_response(RESP_FRAME_TOO_LONG)
+                                discarding = True
+                            else:
+                                # 一次接收即一条命令，粘在一起的心跳已拆成单独的片段
+                                segments = legacy_segments or ((0, end),)
+                                heartbeat = len(segments) > 1
+                                for start, stop in segments:
+                                    if self.dispatch_frame(start, stop):
+                                        heartbeat = True
                             
-                            # 发送响应
-                            response_bytes = response.encode('utf-8')
-                            self.client_socket.send(response_bytes)
-                            print(f"✅ 响应已发送: {len(response_bytes)} 字节")
-                            print("-" * 50)
+                            if heartbeat and not heartbeat_enabled:
+                                heartbeat_enabled = True
+                                print(f"💓 客户端已启用心跳 (间隔 {HEARTBEAT_INTERVAL}秒, 允许丢失 {HEARTBEAT_MISS_LIMIT} 次)")
                             
                         except bluetooth.BluetoothError as e:
                             print(f"❌ 蓝牙通信错误: {e}")
+                            link_lost = True
                             break
                         except Exception as e:
                             print(f"⚠️  通信错误: {e}")
+                            link_lost = True
                             break
                     
+                    self.trace.record(TRACE_LINK, 2 if link_lost else 0)
+                    if link_lost and self.is_running:
+                        self.on_link_lost()
+                    
+                    # 订阅随连接结束
+                    self.stop_telemetry()
+                    
                     # 关闭客户端连接
-                    if self.client_socket:
-                        try:
-                            self.client_socket.close()
-                        except:
-                            pass
-                        self.client_socket = None
+                    self.close_client()
                         
                     print("🔌 连接已断开")
-                    self.display_text("Disconnected\nWaiting...")
+                    self.post_display("Disconnected\nWaiting...")
                     
                 else:
                     print("⚠️  等待连接失败，重试中...")
@@ -773,32 +2730,51 @@ class RaspberryPiController:
     def cleanup(self):
         """清理资源"""
         self.is_running = False
+        self.stop_telemetry()
+        self.stop_local_api()
+        
+        # 提前结束进行中的采样，已采到的结果照常写盘
+        self.profile_stop.set()
+        if self.profile_thread:
+            self.profile_thread.join(timeout=2)
+        self.stop_command_lanes()
         
         # 停止配对代理
         self.stop_pairing_agent()
         
         # 关闭蓝牙连接
-        if self.client_socket:
-            self.client_socket.close()
+        self.close_client()
         if self.server_socket:
             self.server_socket.close()
         
-        # 重置舵机到中位
-        try:
-            self.servo1.value = 0
-            self.servo2.value = 0
-        except:
-            pass
+        # 保存最终状态，下次启动从这里恢复
+        self.state_store.close()
         
-        # 清除显示
-        self.clear_oled()
-        self.display_text("Server Closed")
+        if CENTER_ON_EXIT:
+            # 重置舵机到中位
+            try:
+                self.servo1.value = 0
+                self.servo2.value = 0
+            except:
+                pass
+            
+            # 清除显示
+            self.clear_oled()
+            self.display_text("Server Closed")
+        else:
+            print("💾 保持舵机位置和显示内容，重启后无缝恢复")
         
         print("🧹 清理完成")
 
 def main():
     """主函数"""
+    if REALTIME_MODE:
+        reserve_realtime_cpu()
     controller = RaspberryPiController()
+    # kill -USR1 <pid> 导出命令跟踪
+    signal.signal(signal.SIGUSR1, lambda signum, frame: controller.dump_trace())
+    # kill -USR2 <pid> 启动 PROFILE_SIGNAL_SECONDS 秒的栈采样
+    signal.signal(signal.SIGUSR2, lambda signum, frame: controller.start_profile(PROFILE_SIGNAL_SECONDS))
     
     try:
         controller.run_server()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+网关测试: 用两个 Unix 套接字上的替身控制器验证转发、组寻址、AT: 同步包装、急停直发、错误汇总和客户端令牌
+
+运行: python3 -m unittest discover -s raspberry/tests
+"""
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fleet_gateway
+
+
+class StandInController:
+    """替身控制器: 记录收到的命令，按行回复 OK:<命令>，命令含 FAIL 时回复 ERROR:FAIL"""
+
+    def __init__(self, path):
+        self.path = path
+        self.commands = []
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen(1)
+        threading.Thread(target=self._accept_worker, daemon=True).start()
+
+    def _accept_worker(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._client_worker, args=(conn,), daemon=True).start()
+
+    def _client_worker(self, conn):
+        with conn, conn.makefile("rb") as reader:
+            for line in reader:
+                command = line.decode('utf-8').strip()
+                self.commands.append(command)
+                reply = "ERROR:FAIL" if "FAIL" in command else f"OK:{command}"
+                conn.sendall(reply.encode('utf-8') + b"\n")
+
+    def close(self):
+        self.server.close()
+
+
+class FleetGatewayTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="fleet_test_")
+        self.left = StandInController(os.path.join(self.workdir, "left.sock"))
+        self.right = StandInController(os.path.join(self.workdir, "right.sock"))
+        self.gateway = fleet_gateway.FleetGateway({
+            "controllers": {
+                "left": "unix:" + self.left.path,
+                "right": "unix:" + self.right.path,
+            },
+            "groups": {"arms": ["left", "right"], "solo": ["right"]},
+        })
+
+    def tearDown(self):
+        self.gateway.cleanup()
+        self.left.close()
+        self.right.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def test_single_target_passes_reply_through(self):
+        self.assertEqual(self.gateway.handle_command("@left:SERVO1:90"), "OK:SERVO1:90")
+        self.assertEqual(self.left.commands, ["SERVO1:90"])
+        self.assertEqual(self.right.commands, [])
+
+    def test_group_with_one_member_is_sent_directly(self):
+        self.assertEqual(self.gateway.handle_command("@solo:CENTER"), "OK:CENTER")
+        self.assertEqual(self.right.commands, ["CENTER"])
+        self.assertEqual(self.left.commands, [])
+
+    def test_broadcast_is_wrapped_in_at(self):
+        before = int(time.time() * 1000)
+        self.assertEqual(self.gateway.handle_command("SERVO2:45"), "OK:FLEET:2/2")
+        for controller in (self.left, self.right):
+            self.assertEqual(len(controller.commands), 1)
+            prefix, at_ms, command = controller.commands[0].split(":", 2)
+            self.assertEqual((prefix, command), ("AT", "SERVO2:45"))
+            self.assertGreaterEqual(int(at_ms), before + fleet_gateway.SYNC_DELAY_MS)
+        # 所有控制器拿到同一个执行时间
+        self.assertEqual(self.left.commands, self.right.commands)
+
+    def test_group_delay_override(self):
+        self.gateway.handle_command("@arms+0:OLED:Hi")
+        self.gateway.handle_command("@left,right+250:SERVO1:10")
+        self.assertEqual(self.left.commands[0], "OLED:Hi")
+        at_ms = int(self.right.commands[1].split(":")[1])
+        self.assertAlmostEqual(at_ms, time.time() * 1000 + 250, delta=250)
+
+    def test_stop_bypasses_sync_delay(self):
+        self.assertEqual(self.gateway.handle_command("@arms:STOP"), "OK:FLEET:2/2")
+        self.assertEqual(self.left.commands, ["STOP"])
+        self.assertEqual(self.right.commands, ["STOP"])
+
+    def test_errors_are_aggregated_per_controller(self):
+        self.right.close()
+        os.remove(self.right.path)
+        response = self.gateway.handle_command("@arms+0:FAIL")
+        self.assertTrue(response.startswith("ERROR:FLEET:"))
+        failures = dict(item.split("=", 1) for item in response[len("ERROR:FLEET:"):].split(";"))
+        self.assertEqual(failures, {"left": "ERROR:FAIL", "right": "ERROR:LINK_DOWN"})
+
+    def test_unknown_target_and_status(self):
+        self.assertEqual(self.gateway.handle_command("@nobody:STOP"), "ERROR:FLEET_UNKNOWN_TARGET")
+        self.assertIsNone(self.gateway.handle_command("PING"))
+        self.gateway.handle_command("@left:CENTER")
+        self.assertEqual(self.gateway.handle_command("FLEET?"), "OK:FLEET:left=up,right=down")
+
+    def serve(self, *chunks):
+        """通过 socketpair 把数据送入 serve_client，返回客户端收到的全部响应行"""
+        client, gateway_side = socket.socketpair()
+        worker = threading.Thread(target=self.gateway.serve_client, args=(gateway_side,), daemon=True)
+        worker.start()
+        with client:
+            for chunk in chunks:
+                client.sendall(chunk)
+            client.shutdown(socket.SHUT_WR)
+            worker.join(timeout=2)
+            gateway_side.close()
+            return client.makefile("rb").read().decode('utf-8').splitlines()
+
+    def test_client_must_authenticate_when_token_is_set(self):
+        self.gateway.token = "secret"
+        self.assertEqual(self.serve(b"AUTH:secret\n@left:CENTER\n"), ["OK:AUTH", "OK:CENTER"])
+        self.assertEqual(self.serve(b"AUTH:wrong\n@left:STOP\n"), ["ERROR:AUTH_FAILED"])
+        self.assertEqual(self.serve(b"@left:STOP\n"), ["ERROR:AUTH_FAILED"])
+        self.assertEqual(self.left.commands, ["CENTER"])
+
+    def test_over_long_frame_is_discarded(self):
+        chunk = b"X" * fleet_gateway.RX_BUFFER_SIZE
+        replies = self.serve(b"@left:", chunk, chunk, b"TAIL\n@left:CENTER\n")
+        self.assertEqual(replies, ["ERROR:FRAME_TOO_LONG", "OK:CENTER"])
+        self.assertEqual(self.left.commands, ["CENTER"])
+
+
+if __name__ == "__main__":
+    unittest.main()
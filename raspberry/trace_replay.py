@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+命令跟踪重放工具
+在模拟硬件上把 TRACE_DUMP 导出的跟踪文件重新送入 process_command，用于回归和性能对比
+(只读取跟踪文件的话直接用 command_trace.read_trace，不需要模拟硬件)
+
+用法:
+    python3 trace_replay.py traces/trace-20250101-120000.bin              按原始时间间隔重放
+    python3 trace_replay.py traces/trace-20250101-120000.bin --max-speed  尽快重放，统计处理耗时
+    python3 trace_replay.py <跟踪文件> --lanes                             经过执行器/显示线程 (结果不再确定)
+
+默认在当前线程内顺序执行每条命令，相同的跟踪每次得到相同的结果
+"""
+
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from command_trace import read_trace, TRACE_RX, TRACE_RESP, TRACE_ACTUATE, TRACE_LINK, TRACE_PAYLOAD
+
+TRACE_LINK_LOST = 2  # TRACE_LINK 记录的附加值: 链路丢失 (现场执行了失效保护)
+
+
+class SimulatedServo:
+    """模拟舵机，只记录输出值"""
+
+    def __init__(self, pin, initial_value=0, **kwargs):
+        self.pin = pin
+        self.value = initial_value
+
+
+class SimulatedOLED:
+    """模拟 SSD1306，保留帧缓冲区并统计刷新和命令次数"""
+
+    def __init__(self, width, height, i2c, **kwargs):
+        self.width = width
+        self.height = height
+        self.buffer = bytearray(1 + width * height // 8)
+        self.buffer[0] = 0x40
+        self.shows = 0
+        self.commands = 0
+
+    def fill(self, color):
+        self.buffer[1:] = (b"\xff" if color else b"\x00") * (len(self.buffer) - 1)
+
+    def show(self):
+        self.shows += 1
+
+    def image(self, image):
+        pass
+
+    def write_cmd(self, cmd):
+        self.commands += 1
+
+
+def install_simulated_hardware():
+    """在导入控制器之前，用模拟模块替换蓝牙、GPIO 和 I2C 相关模块"""
+    def module(name, **attrs):
+        mod = types.ModuleType(name)
+        mod.__dict__.update(attrs)
+        sys.modules[name] = mod
+        return mod
+
+    class BluetoothError(IOError):
+        pass
+
+    class Device:
+        pin_factory = None
+
+    module("bluetooth", BluetoothError=BluetoothError, RFCOMM=3, PORT_ANY=0)
+    module("gpiozero", Servo=SimulatedServo, Device=Device)
+    module("gpiozero.pins")
+    module("gpiozero.pins.pigpio", PiGPIOFactory=lambda: None)
+    module("board", SCL=None, SDA=None)
+    module("busio", I2C=lambda scl, sda: None)
+    module("adafruit_ssd1306", SSD1306_I2C=SimulatedOLED)
+
+
+def percentile(samples, fraction):
+    """已排序样本的分位数"""
+    return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+
+def replay(controller, records, max_speed, lanes):
+    """把跟踪中收到的帧依次送入控制器 (链路丢失时同样执行失效保护)，返回 (处理耗时列表, 响应列表, 跳过的截断帧数)"""
+    from raspberry_pi_controller import DISPLAY_COMMAND_PREFIXES
+
+    frames = [record for record in records
+              if record[1] == TRACE_RX or (record[1] == TRACE_LINK and record[2] == TRACE_LINK_LOST)]
+    timings = []
+    responses = []
+    truncated = 0
+    if not frames:
+        return timings, responses, truncated
+
+    first_timestamp = frames[0][0]
+    started = time.monotonic()
+    for timestamp, kind, aux, length, value, payload in frames:
+        if length > TRACE_PAYLOAD:
+            truncated += 1
+            continue
+        if not max_speed:
+            delay = (timestamp - first_timestamp) - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        if kind == TRACE_LINK:
+            controller.on_link_lost()
+            continue
+        command = payload.decode('utf-8', 'replace')
+        begin = time.perf_counter()
+        if lanes and command.startswith(DISPLAY_COMMAND_PREFIXES):
+            controller.submit_display_command(command, responses.append)
+        else:
+            response = controller.process_command(command)
+            if response is not None:
+                responses.append(response.encode('utf-8'))
+        timings.append(time.perf_counter() - begin)
+    return timings, responses, truncated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在模拟硬件上重放命令跟踪")
+    parser.add_argument("trace", help="TRACE_DUMP 导出的跟踪文件")
+    parser.add_argument("--max-speed", action="store_true", help="忽略原始时间间隔，尽快重放")
+    parser.add_argument("--lanes", action="store_true", help="启动执行器和显示线程，与现场运行方式一致")
+    parser.add_argument("--verbose", action="store_true", help="显示控制器自身的输出")
+    args = parser.parse_args()
+
+    try:
+        header, records = read_trace(args.trace)
+    except (OSError, ValueError) as e:
+        print(f"❌ 无法读取跟踪文件: {e}")
+        sys.exit(1)
+    dumped_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(header[4]))
+    span = records[-1][0] - records[0][0] if records else 0.0
+    print(f"📼 跟踪文件: {args.trace} ({len(records)} 条记录，跨度 {span:.1f}秒，导出于 {dumped_at})")
+
+    # 重放使用临时的状态/校准/图标/跟踪/采样目录，跟踪中的 CALIBRATE/ICON_SAVE 等命令不会改写本机上的真实数据
+    workdir = tempfile.mkdtemp(prefix="trace_replay_")
+    os.environ["RPI_STATE_FILE"] = os.path.join(workdir, "controller_state.log")
+    calibration = os.environ.get(
+        "RPI_CALIBRATION_FILE",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "servo_calibration.json"))
+    os.environ["RPI_CALIBRATION_FILE"] = os.path.join(workdir, "servo_calibration.json")
+    if os.path.exists(calibration):
+        # 用本机校准的副本重放，角度映射与现场一致
+        shutil.copy(calibration, os.environ["RPI_CALIBRATION_FILE"])
+    os.environ["RPI_ICON_DIR"] = os.path.join(workdir, "oled_icons")
+    os.environ["RPI_TRACE_DIR"] = os.path.join(workdir, "traces")
+    os.environ["RPI_PROFILE_DIR"] = os.path.join(workdir, "profiles")
+    os.environ["RPI_LOCAL_SOCKET"] = ""
+
+    install_simulated_hardware()
+    import raspberry_pi_controller as rpc
+
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(output):
+        controller = rpc.RaspberryPiController()
+        if args.lanes:
+            controller.start_command_lanes()
+        started = time.monotonic()
+        timings, responses, truncated = replay(controller, records, args.max_speed, args.lanes)
+        if args.lanes:
+            # 等待显示通道处理完，再留一个节拍输出最后的舵机目标
+            while controller.display_queue:
+                time.sleep(0.01)
+            time.sleep(rpc.ACTUATOR_TICK * 2)
+            controller.stop_command_lanes()
+        elapsed = time.monotonic() - started
+        controller.state_store.close()
+
+    print(f"▶️ 重放 {len(timings)} 条命令，耗时 {elapsed:.3f}秒"
+          + (f" (跳过 {truncated} 条截断的帧)" if truncated else ""))
+    if timings:
+        samples = sorted(timings)
+        mean = sum(samples) / len(samples)
+        print(f"⏱️ 处理耗时: 平均 {mean * 1e6:.0f}us, p99 {percentile(samples, 0.99) * 1e6:.0f}us, "
+              f"最大 {samples[-1] * 1e6:.0f}us")
+
+    # 与跟踪中记录的结果对比
+    expected_angles = [None, None]
+    expected_responses = Counter()
+    for timestamp, kind, aux, length, value, payload in records:
+        if kind == TRACE_ACTUATE and aux < 2:
+            expected_angles[aux] = round(value, 1)
+        elif kind == TRACE_RESP:
+            expected_responses[payload] += 1
+    replayed_responses = Counter(response[:TRACE_PAYLOAD] for response in responses)
+    matched = sum((expected_responses & replayed_responses).values())
+    print(f"📨 响应: {matched}/{sum(expected_responses.values())} 与跟踪一致")
+
+    replayed_angles = [round(float(angle), 1) for angle in controller.servo_angles]
+    mismatched = [i for i in (0, 1)
+                  if expected_angles[i] is not None and expected_angles[i] != replayed_angles[i]]
+    print(f"🎯 最终舵机角度: 重放 {replayed_angles} / 跟踪 {expected_angles}"
+          + (" ❌ 不一致" if mismatched else " ✅"))
+    if mismatched:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()